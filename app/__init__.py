@@ -1,33 +1,62 @@
-from datetime import timedelta
+import sqlite3
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-from flask_marshmallow import Marshmallow
-from flask_httpauth import HTTPBasicAuth
 from flask_login import LoginManager
-from flask_mail import Mail
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
+from app.config import Config
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database/db.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = "your_super_secret_key"
-app.config['MAIL_SERVER'] = 'mailserver'
-app.config['MAIL_PORT'] = 25
-app.config['MAIL_USE_TLS'] = False
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)
 
-
-db = SQLAlchemy(app)
-migrate = Migrate(app, db, render_as_batch=True)
-ma = Marshmallow(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
+db = SQLAlchemy()
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'
 login_manager.login_message_category = 'info'
-mail = Mail(app)
-authorize = HTTPBasicAuth()
-
 
 
-from app import routes
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL lets readers carry on while a writer commits, the busy timeout itself comes from SQLITE_BUSY_TIMEOUT through
+    the connect args.
+    """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+
+def create_app(config=Config, web=True):
+    """
+    Builds the application. Nothing is connected to or created until this is called, and the web side (forms, the API
+    and migrations) is only imported for the web app, so the sender and worker start without it.
+
+    :param config: Settings object, see app.config.Config
+    :param web: Set up the web pages and API, False gives a bare app with just the database for sending
+    :return: Flask app
+    """
+    app = Flask(__name__)
+    app.config.from_object(config)
+    db.init_app(app)
+    if web:
+        from app.extensions import migrate, ma
+        from app.routes import bp, api
+        migrate.init_app(app, db, render_as_batch=True)
+        ma.init_app(app)
+        login_manager.init_app(app)
+        app.register_blueprint(bp)
+        api.init_app(app)
+    return app
+
+
+def init_db(app):
+    """
+    Creates any missing tables, for a brand new database. Existing databases are upgraded with `flask db upgrade`.
+
+    :param app: Flask app
+    """
+    from app import models
+    with app.app_context():
+        db.create_all()
@@ -0,0 +1,9 @@
+from flask_httpauth import HTTPBasicAuth
+from flask_marshmallow import Marshmallow
+from flask_migrate import Migrate
+
+
+# Only the web app uses these, create_app sets them up
+migrate = Migrate()
+ma = Marshmallow()
+authorize = HTTPBasicAuth()
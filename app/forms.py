@@ -1,16 +1,29 @@
+from email_validator import validate_email, EmailNotValidError
 from flask_login import current_user
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, BooleanField, IntegerField
+from wtforms import StringField, PasswordField, SubmitField, BooleanField, IntegerField, SelectField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError, URL
-from app.models import User
+from app.models import User, CHANNEL_TYPES
 
 
 class NotificationForm(FlaskForm):
     team_name = StringField('Team Name', validators=[DataRequired()])
-    teams_channel_url = StringField('Channel Webhook URL', validators=[DataRequired(), URL()])
+    channel_type = SelectField('Channel Type', choices=list(CHANNEL_TYPES.items()), default='teams')
+    teams_channel_url = StringField('Channel Webhook URL or Email Addresses', validators=[DataRequired()])
     enabled = BooleanField('Enabled')
+    topics = StringField('Topics', description='Comma separated, e.g. deploys, outages')
     submit = SubmitField('Save')
 
+    def validate_teams_channel_url(self, teams_channel_url):
+        if self.channel_type.data != 'email':
+            URL()(self, teams_channel_url)
+            return
+        for address in teams_channel_url.data.split(','):
+            try:
+                validate_email(address.strip(), check_deliverability=False)
+            except EmailNotValidError:
+                raise ValidationError(f"'{address.strip()}' is not a valid email address")
+
 
 class UpdateAccountForm(FlaskForm):
     username = StringField('Username',
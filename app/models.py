@@ -1,9 +1,9 @@
+from flask import current_app
 from flask_login import UserMixin
 
-from app import app, db, ma, login_manager
+from app import db, login_manager
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from passlib.apps import custom_app_context as pwd_context
-from sqlalchemy_utils.functions import database_exists
 
 @login_manager.user_loader
 def load_user(userid):
@@ -24,12 +24,12 @@ class User(db.Model, UserMixin):
     token = db.Column(db.String(1000))
 
     def get_reset_token(self, expires_sec=1800):
-        s = Serializer(app.config['SECRET_KEY'], expires_sec)
+        s = Serializer(current_app.config['SECRET_KEY'], expires_sec)
         return s.dumps({'user_id': self.id}).decode('utf-8')
 
     @staticmethod
     def verify_reset_token(token):
-        s = Serializer(app.config['SECRET_KEY'])
+        s = Serializer(current_app.config['SECRET_KEY'])
         try:
             user_id = s.loads(token)['user_id']
         except:
@@ -57,51 +57,150 @@ class User(db.Model, UserMixin):
         return f"User('{self.id}', '{self.username}', '{self.email}')"
 
 
-class UserSchema(ma.SQLAlchemyAutoSchema):
-    class Meta:
-        model = User
-        include_relationships = True
-        load_instance = True
+notification_topics = db.Table(
+    'notification_topics',
+    db.Column('notification_id', db.Integer, db.ForeignKey('notifications.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('topic_id', db.Integer, db.ForeignKey('topics.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_notification_topics_topic_id', 'topic_id', 'notification_id'),
+)
 
-    id = ma.auto_field()
-    username = ma.auto_field()
-    password = ma.auto_field()
-    firstname = ma.auto_field()
-    lastname = ma.auto_field()
-    email = ma.auto_field()
-    disabled = ma.auto_field()
-    admin = ma.auto_field()
-    token = ma.auto_field()
+
+class Topic(db.Model):
+    """
+    A kind of notification teams can subscribe to, e.g. 'deploys' or 'outages'. Subscriptions live in
+    notification_topics, so adding a new kind of notification is a new row rather than a new column.
+    """
+    __tablename__ = "topics"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), unique=True, index=True)
+
+    def __repr__(self):
+        return f"Topic('{self.id}', '{self.name}')"
+
+
+# channel_type of a notification, each has an adapter in lib.notifications.adapters. For email channels channel_url
+# holds comma separated addresses, for the others a webhook URL.
+CHANNEL_TYPES = {'teams': 'Teams webhook', 'slack': 'Slack webhook', 'webhook': 'JSON webhook', 'email': 'Email'}
 
 
 class Notifications(db.Model):
     """
     Defines the table structure for 'notifications'. Feel free to add other columns to make the notifications more
-    customizable. Just remember to update the form, template and schema to reflect the ones you add.
+    customizable. Just remember to update the form, template and schema to reflect the ones you add. To let teams pick
+    which notifications they get, subscribe them to topics rather than adding a column per notification type.
     """
     __tablename__ = "notifications"
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, unique=True)
     channel_url = db.Column(db.String, unique=True)
-    enabled = db.Column(db.Integer)
+    channel_type = db.Column(db.String(16), default='teams', server_default='teams')
+    enabled = db.Column(db.Integer, index=True)
+    disabled_reason = db.Column(db.String)
     created = db.Column(db.String)
     updated = db.Column(db.String)
+    topics = db.relationship('Topic', secondary=notification_topics, backref='subscribers')
+
+
+class Outbox(db.Model):
+    """
+    Outbound message queue. Each row is one message and the teams it goes to (targets is a JSON list of notification
+    ids, or empty for every enabled team). Workers claim rows by setting a lease, so several workers can drain the
+    queue at once without sending the same message twice.
+    """
+    __tablename__ = "notification_outbox"
+    __table_args__ = (db.Index('ix_notification_outbox_claim', 'status', 'priority', 'available_at'),)
+    id = db.Column(db.Integer, primary_key=True)
+    payload = db.Column(db.Text)
+    targets = db.Column(db.Text)
+    status = db.Column(db.String(16), default='pending', index=True)
+    attempts = db.Column(db.Integer, default=0)
+    lease_owner = db.Column(db.String(64))
+    lease_expires = db.Column(db.Float)
+    available_at = db.Column(db.Float)
+    last_error = db.Column(db.Text)
+    dedup_key = db.Column(db.String(255), index=True)
+    batch_id = db.Column(db.String(32), index=True)
+    priority = db.Column(db.Integer, default=1, index=True)
+    kind = db.Column(db.String(16), default='card', server_default='card')
+    created = db.Column(db.Float)
+    updated = db.Column(db.Float)
+
+
+class RateLimitBucket(db.Model):
+    """
+    Token bucket state shared by every process that sends, one row per channel URL plus one for the global cap.
+    """
+    __tablename__ = "rate_limit_buckets"
+    key = db.Column(db.String, primary_key=True)
+    tokens = db.Column(db.Float)
+    updated = db.Column(db.Float)
+    version = db.Column(db.Integer, default=0)
+
 
+class RegistryVersion(db.Model):
+    """
+    A single row counting changes to the notifications table. Every process compares it with the version its channel
+    registry was loaded at, so a team added in the web app reaches the outbox worker without a restart.
+    """
+    __tablename__ = "channel_registry_version"
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, default=0)
+
+
+class Schedule(db.Model):
+    """
+    A message the outbox worker queues on a cron schedule. next_run is worked out from cron every time it fires.
+    """
+    __tablename__ = "notification_schedules"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), unique=True, index=True)
+    cron = db.Column(db.String(100))
+    payload = db.Column(db.Text)
+    targets = db.Column(db.Text)
+    priority = db.Column(db.Integer, default=1)
+    enabled = db.Column(db.Integer, default=1)
+    next_run = db.Column(db.Float, index=True)
+    last_run = db.Column(db.Float)
+    created = db.Column(db.Float)
+    updated = db.Column(db.Float)
+
+
+class DigestItem(db.Model):
+    """
+    A low priority message held back until the next digest, which sends each team one card of its messages.
+    """
+    __tablename__ = "notification_digest"
+    id = db.Column(db.Integer, primary_key=True)
+    payload = db.Column(db.Text)
+    targets = db.Column(db.Text)
+    created = db.Column(db.Float)
 
-class NotificationsSchema(ma.SQLAlchemyAutoSchema):
-    class Meta:
-        model = Notifications
-        include_relationships = True
-        load_instance = True
 
-    id = ma.auto_field()
-    name = ma.auto_field()
-    channel_url = ma.auto_field()
-    enabled = ma.auto_field()
-    created = ma.auto_field()
-    updated = ma.auto_field()
+class Delivery(db.Model):
+    """
+    One delivery of a message to a team: how it went, the HTTP status, how long it took and how many attempts it
+    needed. Rows older than the retention period are rolled up into DeliveryRollup.
+    """
+    __tablename__ = "deliveries"
+    __table_args__ = (db.Index('ix_deliveries_channel_id_created', 'channel_id', 'created'),)
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.String(32), index=True)
+    channel_id = db.Column(db.Integer)
+    status = db.Column(db.String(16))
+    http_status = db.Column(db.Integer)
+    latency = db.Column(db.Float)
+    attempts = db.Column(db.Integer)
+    error = db.Column(db.String(500))
+    created = db.Column(db.Float, index=True)
 
 
-if not database_exists(app.config["SQLALCHEMY_DATABASE_URI"]):
-    db.create_all()
-    db.session.commit()
+class DeliveryRollup(db.Model):
+    """
+    Daily totals of deliveries that have been compacted, per team and status
+    """
+    __tablename__ = "delivery_rollups"
+    day = db.Column(db.String(10), primary_key=True)
+    channel_id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(16), primary_key=True)
+    count = db.Column(db.Integer, default=0)
+    total_latency = db.Column(db.Float, default=0.0)
@@ -1,61 +1,214 @@
 from datetime import datetime, timedelta
+from functools import wraps
+
+import time
+import uuid
 
 import jwt
-from flask import render_template, url_for, flash, redirect, request, session, make_response, jsonify, g
+from flask import render_template, url_for, flash, redirect, request, session, make_response, jsonify, g, \
+    current_app, Blueprint
 from flask_login import current_user, login_user, logout_user, login_required
-from flask_mail import Message
 from flask_restful import reqparse, abort
 from flask_restplus import Api, Resource, fields
-from app import app, db, mail
+from sqlalchemy import or_
+from app import db
+from app.extensions import authorize
 from app.forms import NotificationForm, RegistrationForm, LoginForm, ResetPasswordForm, RequestResetForm, \
     UserManagementForm, UpdateAccountForm
-from app.models import Notifications, User
+from app.models import Notifications, Topic, User, Schedule, Delivery
+from lib.notifications import outbox, metrics, scheduler, deliveries, send_email
+from lib.notifications.cards import build_card
+from lib.notifications.registry import channels
+
+
+bp = Blueprint('main', __name__)
 
 
 def generate_token(user):
     response = jwt.encode({'user': user.username, 'exp': datetime.utcnow() + timedelta(hours=24)},
-                          app.config['SECRET_KEY'])
+                          current_app.config['SECRET_KEY'])
     return response
 
 
-@app.route("/")
-@app.route("/home")
+def admin_required(message='Only Admins can do that!', endpoint='main.home'):
+    """
+    Only lets admins into a view. Uses the user login_manager already loaded for this request, so checking costs no
+    extra queries.
+
+    :param message: Flashed when the user isn't an admin
+    :param endpoint: Where to send users that aren't admins
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not current_user.is_authenticated or current_user.admin != 1:
+                flash(message, 'danger')
+                return redirect(url_for(endpoint))
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@authorize.verify_password
+def verify_password(username_or_token, password):
+    """
+    Lets API clients authenticate with either the JWT from their account page or their username and password
+    """
+    try:
+        data = jwt.decode(username_or_token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
+        user = User.query.filter_by(username=data['user']).first()
+    except jwt.InvalidTokenError:
+        user = User.query.filter_by(username=username_or_token).first()
+        if not user or not user.verify_password(password):
+            return False
+    if not user or user.disabled == 1:
+        return False
+    g.user = user
+    return True
+
+
+def keyset_page(query, column, args, descending=False):
+    """
+    Gets one page of a listing, starting after the id given in the 'after' argument. Seeking on the primary key keeps
+    every page as cheap as the first one no matter how far in it is.
+
+    :param query: Query to page through
+    :param column: Primary key column the listing is ordered by
+    :param args: Request arguments, 'after' and 'limit' are used
+    :param descending: List newest first
+    :return: Tuple of the rows on this page and the 'after' value for the next page, or None on the last page
+    """
+    limit = max(min(args.get('limit', 50, type=int), 200), 1)
+    after = args.get('after', type=int)
+    if after is not None:
+        query = query.filter(column < after if descending else column > after)
+    rows = query.order_by(column.desc() if descending else column).limit(limit + 1).all()
+    next_after = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_after
+
+
+def flag_filter(query, column, value):
+    """
+    Filters a 0/1 column on a '0' or '1' request argument, anything else leaves the query alone
+    """
+    if value in ('0', '1'):
+        return query.filter(column == int(value))
+    return query
+
+
+def notification_listing(args):
+    """
+    Notifications page listing, searchable by name and filterable on 'enabled'
+    """
+    query = Notifications.query.with_entities(Notifications.id, Notifications.name, Notifications.channel_type,
+                                              Notifications.enabled, Notifications.disabled_reason,
+                                              Notifications.updated)
+    if args.get('q'):
+        query = query.filter(Notifications.name.ilike(f"%{args['q']}%"))
+    query = flag_filter(query, Notifications.enabled, args.get('enabled'))
+    return keyset_page(query, Notifications.id, args)
+
+
+def user_listing(args):
+    """
+    Users page listing, searchable by username or email and filterable on 'admin' and 'disabled'
+    """
+    query = User.query.with_entities(User.id, User.username, User.email, User.firstname, User.lastname,
+                                     User.admin, User.disabled)
+    if args.get('q'):
+        query = query.filter(or_(User.username.ilike(f"%{args['q']}%"), User.email.ilike(f"%{args['q']}%")))
+    query = flag_filter(query, User.admin, args.get('admin'))
+    query = flag_filter(query, User.disabled, args.get('disabled'))
+    return keyset_page(query, User.id, args)
+
+
+def delivery_listing(args):
+    """
+    Delivery log listing, newest first, filterable on team name, status, message id and age in days
+    """
+    query = Delivery.query.outerjoin(Notifications, Notifications.id == Delivery.channel_id).with_entities(
+        Delivery.id, Delivery.message_id, Delivery.status, Delivery.http_status, Delivery.latency, Delivery.attempts,
+        Delivery.error, Delivery.created, Notifications.name)
+    if args.get('team'):
+        query = query.filter(Notifications.name == args['team'])
+    if args.get('status') in deliveries.STATUSES:
+        query = query.filter(Delivery.status == args['status'])
+    if args.get('message_id'):
+        query = query.filter(Delivery.message_id == args['message_id'])
+    days = args.get('days', type=float)
+    if days:
+        query = query.filter(Delivery.created >= datetime.utcnow().timestamp() - days * 86400)
+    return keyset_page(query, Delivery.id, args, descending=True)
+
+
+def next_page_url(next_after):
+    if next_after is None:
+        return None
+    args = request.args.to_dict()
+    args['after'] = next_after
+    return url_for(request.endpoint, **args)
+
+
+def get_topics(names):
+    """
+    Turns a comma separated list of topic names into Topic rows, creating any that don't exist yet
+    """
+    names = sorted({name.strip() for name in (names or '').split(',') if name.strip()})
+    if not names:
+        return []
+    topics = Topic.query.filter(Topic.name.in_(names)).all()
+    known = {topic.name for topic in topics}
+    for name in names:
+        if name not in known:
+            topic = Topic(name=name)
+            db.session.add(topic)
+            topics.append(topic)
+    return topics
+
+
+@bp.route("/")
+@bp.route("/home")
 def home():
     return render_template('home.html')
 
 
-@app.route("/login", methods=['GET', 'POST'])
+@bp.route("/metrics")
+def metrics_page():
+    return make_response(metrics.registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'})
+
+
+@bp.route("/login", methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         if user and user.verify_password(form.password.data):
             if user.disabled == 1:
                 flash('This account has not been enabled! Please contact a site admin', 'danger')
-                return redirect(url_for('home'))
+                return redirect(url_for('main.home'))
             login_user(user, remember=form.remember.data)
             next_page = request.args.get('next')
             token = generate_token(user)
             setattr(user, 'token', token)
             db.session.commit()
             flash("Login Successful", 'success')
-            return redirect(next_page) if next_page else redirect(url_for('home'))
+            return redirect(next_page) if next_page else redirect(url_for('main.home'))
         else:
             flash('Login Unsuccessful. Please check email and password', 'danger')
     return render_template('login.html', title='Login', form=form)
 
 
-@app.route("/register", methods=['GET', 'POST'])
+@bp.route("/register", methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     form = RegistrationForm()
-    users_exist = User.query.all()
     if form.validate_on_submit():
         # Do any users exist? If not, make first user admin
-        if len(users_exist) == 0:
+        users_exist = db.session.query(User.query.exists()).scalar()
+        if not users_exist:
             user = User(username=form.username.data, email=form.email.data, password=form.password.data, admin=1,
                         disabled=0)
         else:
@@ -65,11 +218,11 @@ def register():
         user.hash_password(form.password.data)
         db.session.add(user)
         db.session.commit()
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     return render_template('register.html', title="Register", form=form)
 
 
-@app.route("/account", methods=['GET', 'POST'])
+@bp.route("/account", methods=['GET', 'POST'])
 @login_required
 def account():
     form = UpdateAccountForm()
@@ -78,190 +231,371 @@ def account():
         current_user.email = form.email.data
         db.session.commit()
         flash('Your account has been updated!', 'success')
-        return redirect(url_for('account'))
+        return redirect(url_for('main.account'))
     elif request.method == 'GET':
         form.username.data = current_user.username
         form.email.data = current_user.email
-    user = User.query.filter_by(username=current_user.username).first()
-    user_token = user.token.decode('utf-8')
+    user_token = current_user.token.decode('utf-8')
     return render_template('account.html', title='Account', form=form, user_token=user_token)
 
 
-@app.route("/logout")
+@bp.route("/logout")
 def logout():
     logout_user()
-    return redirect(url_for('home'))
+    return redirect(url_for('main.home'))
 
 
-@app.route("/users", methods=['GET', 'POST'])
+@bp.route("/deliveries")
 @login_required
+@admin_required()
+def delivery_log():
+    rows, next_after = delivery_listing(request.args)
+    return render_template('deliveries.html', deliveries=rows, statuses=deliveries.STATUSES, legend='Delivery Log',
+                           next_url=next_page_url(next_after), datetime=datetime)
+
+
+@bp.route("/users", methods=['GET', 'POST'])
+@login_required
+@admin_required()
 def user_management():
-    all_users = User.query.all()
-    user = User.query.filter_by(username=current_user.username).first()
-    if user.admin == 1:
-        return render_template('accounts.html', all_users=all_users, legend='Account Management')
-    flash('Only Admins can do that!', 'danger')
-    return redirect(url_for('home'))
+    all_users, next_after = user_listing(request.args)
+    return render_template('accounts.html', all_users=all_users, legend='Account Management',
+                           next_url=next_page_url(next_after))
 
 
-@app.route("/users/<int:user_id>/edit", methods=['GET', 'POST'])
+@bp.route("/users/<int:user_id>/edit", methods=['GET', 'POST'])
 @login_required
+@admin_required()
 def single_user(user_id):
     edit_user = User.query.filter_by(id=user_id).first()
     if not edit_user:
         flash(f'That user does not exist!', 'warning')
-        return redirect(url_for('home'))
-    user = User.query.filter_by(username=current_user.username).first()
-    if user.admin == 1:
-        form = UserManagementForm()
-        if form.validate_on_submit():
-            user_id = form.user_id.data
-            username = form.username.data
-            email = form.email.data
-            first_name = form.first_name.data
-            last_name = form.last_name.data
-            disabled = form.disabled.data
-            admin = form.admin.data
-            user_to_edit = User.query.filter_by(id=user_id).first()
-            if form.delete.data:
-                if user_to_edit.username == current_user.username:
-                    flash(f"You can't delete yourself!", 'danger')
-                    return redirect(url_for('user_management'))
-                db.session.delete(user_to_edit)
-                db.session.commit()
-                flash(f'{username} has been deleted!', 'success')
-                return redirect(url_for('user_management'))
-            setattr(user_to_edit, 'username', username)
-            setattr(user_to_edit, 'email', email)
-            setattr(user_to_edit, 'firstname', first_name)
-            setattr(user_to_edit, 'lastname', last_name)
-            setattr(user_to_edit, 'disabled', disabled)
-            setattr(user_to_edit, 'admin', admin)
+        return redirect(url_for('main.home'))
+    form = UserManagementForm()
+    if form.validate_on_submit():
+        user_id = form.user_id.data
+        username = form.username.data
+        email = form.email.data
+        first_name = form.first_name.data
+        last_name = form.last_name.data
+        disabled = form.disabled.data
+        admin = form.admin.data
+        user_to_edit = User.query.filter_by(id=user_id).first()
+        if form.delete.data:
+            if user_to_edit.username == current_user.username:
+                flash(f"You can't delete yourself!", 'danger')
+                return redirect(url_for('main.user_management'))
+            db.session.delete(user_to_edit)
             db.session.commit()
-            flash('User updated', 'success')
-            return redirect(url_for('user_management'))
-        elif request.method == 'GET':
-            form.username.data = edit_user.username
-            form.email.data = edit_user.email
-            form.user_id.data = edit_user.id
-            form.first_name.data = edit_user.firstname
-            form.last_name.data = edit_user.lastname
-            form.disabled.data = edit_user.disabled
-            form.admin.data = edit_user.admin
-        return render_template('single_user.html', user=edit_user, form=form, legend=f'Edit {edit_user.username}')
-    flash('Only Admins can do that!', 'danger')
-    return redirect(url_for('home'))
+            flash(f'{username} has been deleted!', 'success')
+            return redirect(url_for('main.user_management'))
+        setattr(user_to_edit, 'username', username)
+        setattr(user_to_edit, 'email', email)
+        setattr(user_to_edit, 'firstname', first_name)
+        setattr(user_to_edit, 'lastname', last_name)
+        setattr(user_to_edit, 'disabled', disabled)
+        setattr(user_to_edit, 'admin', admin)
+        db.session.commit()
+        flash('User updated', 'success')
+        return redirect(url_for('main.user_management'))
+    elif request.method == 'GET':
+        form.username.data = edit_user.username
+        form.email.data = edit_user.email
+        form.user_id.data = edit_user.id
+        form.first_name.data = edit_user.firstname
+        form.last_name.data = edit_user.lastname
+        form.disabled.data = edit_user.disabled
+        form.admin.data = edit_user.admin
+    return render_template('single_user.html', user=edit_user, form=form, legend=f'Edit {edit_user.username}')
 
 
 def send_reset_email(user):
     token = user.get_reset_token()
-    msg = Message('Password Reset Request',
-                  sender='noreply@tripwirelab.com',
-                  recipients=[user.email])
-    msg.body = f'''To reset your password, visit the following link:
-{url_for('reset_token', token=token, _external=True)}
+    body = f'''To reset your password, visit the following link:
+{url_for('main.reset_token', token=token, _external=True)}
 If you did not make this request then simply ignore this email and no changes will be made.
 '''
-    mail.send(msg)
+    # Queued for the outbox worker so a slow mail server never holds up the request
+    send_email([user.email], 'Password Reset Request', body)
 
 
-@app.route("/reset_password", methods=['GET', 'POST'])
+@bp.route("/reset_password", methods=['GET', 'POST'])
 def reset_request():
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     form = RequestResetForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         send_reset_email(user)
         flash('An email has been sent with instructions to reset your password.', 'info')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('reset_request.html', title='Reset Password', form=form)
 
 
-@app.route("/reset_password/<token>", methods=['GET', 'POST'])
+@bp.route("/reset_password/<token>", methods=['GET', 'POST'])
 def reset_token(token):
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     user = User.verify_reset_token(token)
     if user is None:
         flash('That is an invalid or expired token', 'warning')
-        return redirect(url_for('reset_request'))
+        return redirect(url_for('main.reset_request'))
     form = ResetPasswordForm()
     if form.validate_on_submit():
         user.hash_password(form.password.data)
         db.session.commit()
         flash('Your password has been updated! You are now able to log in', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('reset_token.html', title='Reset Password', form=form)
 
 
-@app.route("/notifications", methods=['GET'])
+@bp.route("/notifications", methods=['GET'])
 def notifications_page():
-    notification_settings = Notifications.query.all()
-    if current_user.is_authenticated:
-        user = User.query.filter_by(username=current_user.username).first()
-    else:
-        user = None
-    return render_template('notifications.html', notification_settings=notification_settings, user=user)
+    notification_settings, next_after = notification_listing(request.args)
+    user = current_user if current_user.is_authenticated else None
+    return render_template('notifications.html', notification_settings=notification_settings, user=user,
+                           next_url=next_page_url(next_after))
 
 
-@app.route("/notification/<int:notification_id>/delete", methods=['GET'])
+@bp.route("/notification/<int:notification_id>/delete", methods=['GET'])
+@admin_required('Access Denied', 'main.notifications_page')
 def delete_notification(notification_id):
-    if current_user.is_authenticated:
-        user = User.query.filter_by(username=current_user.username).first()
-        if user.admin != 1:
-            flash('Access Denied', 'danger')
-            return redirect(url_for('notifications_page'))
-        notification = Notifications.query.filter_by(id=notification_id).first()
-        db.session.delete(notification)
-        db.session.commit()
-        flash('Your team notification has been deleted!', 'success')
-        return redirect(url_for('notifications_page'))
-    else:
-        flash('Access Denied', 'danger')
-        return redirect(url_for('notifications_page'))
+    notification = Notifications.query.filter_by(id=notification_id).first()
+    db.session.delete(notification)
+    version = channels.changed()
+    db.session.commit()
+    channels.discard(notification_id, version)
+    flash('Your team notification has been deleted!', 'success')
+    return redirect(url_for('main.notifications_page'))
 
 
-@app.route("/notifications/new", methods=['GET', 'POST'])
+@bp.route("/notifications/new", methods=['GET', 'POST'])
 def new_notification():
     form = NotificationForm()
     if form.validate_on_submit():
         notification = Notifications()
-        notification.team_name = form.team_name.data
-        notification.teams_channel_url = form.teams_channel_url.data
-        notification.enabled = form.enabled.data
+        notification.name = form.team_name.data
+        notification.channel_url = form.teams_channel_url.data
+        notification.channel_type = form.channel_type.data
+        notification.enabled = int(form.enabled.data)
+        notification.topics = get_topics(form.topics.data)
         notification.updated = datetime.today().date()
         db.session.add(notification)
+        version = channels.changed()
         db.session.commit()
+        channels.upsert(notification, version)
         flash('Your team notification has been created!', 'success')
-        return redirect(url_for('notifications_page'))
+        return redirect(url_for('main.notifications_page'))
     return render_template('create_notification.html', title='Add New Notification',
                            form=form, legend='Add New Notification')
 
 
-@app.route("/notifications/edit/<int:id>", methods=['GET', 'POST'])
+@bp.route("/notifications/edit/<int:id>", methods=['GET', 'POST'])
+@admin_required('Only Administrators can manage notification settings', 'main.notifications_page')
 def edit_notifications(id):
     notification = Notifications.query.get_or_404(id)
-    if current_user.is_authenticated:
-        user = User.query.filter_by(username=current_user.username).first()
-        if user.admin != 1:
-            flash('Access Denied', 'danger')
-            return redirect(url_for('notifications_page'))
-        form = NotificationForm()
-        if form.validate_on_submit():
-            notification.team_name = form.team_name.data
-            notification.teams_channel_url = form.teams_channel_url.data
-            notification.enabled = form.enabled.data
-            notification.updated = datetime.today().date()
-            db.session.commit()
-            flash('Your team notification has been updated!', 'success')
-            return redirect(url_for('notifications_page'))
-        elif request.method == 'GET':
-            form.team_name.data = notification.team_name
-            form.teams_channel_url.data = notification.teams_channel_url
-            form.enabled.data = notification.enabled
-
-        return render_template('create_notification.html', title='Update Notification Settings',
-                               form=form, legend='Update Notification Settings')
-    flash('Only Administrators can manage notification settings', 'danger')
-    return redirect(url_for('notifications_page'))
+    form = NotificationForm()
+    if form.validate_on_submit():
+        notification.name = form.team_name.data
+        notification.channel_url = form.teams_channel_url.data
+        notification.channel_type = form.channel_type.data
+        notification.enabled = int(form.enabled.data)
+        if notification.enabled:
+            notification.disabled_reason = None
+        notification.topics = get_topics(form.topics.data)
+        notification.updated = datetime.today().date()
+        version = channels.changed()
+        db.session.commit()
+        channels.upsert(notification, version)
+        flash('Your team notification has been updated!', 'success')
+        return redirect(url_for('main.notifications_page'))
+    elif request.method == 'GET':
+        form.team_name.data = notification.name
+        form.teams_channel_url.data = notification.channel_url
+        form.channel_type.data = notification.channel_type
+        form.enabled.data = notification.enabled
+        form.topics.data = ', '.join(topic.name for topic in notification.topics)
+
+    return render_template('create_notification.html', title='Update Notification Settings',
+                           form=form, legend='Update Notification Settings')
+
+
+api = Api(prefix='/api', doc='/api/docs', title='Notifications API')
+ns = api.namespace('notifications', description='Queue notifications for delivery')
+
+message_model = api.model('Message', {
+    'title': fields.String(description='Card title'),
+    'text': fields.String(description='Card text'),
+    'summary': fields.String(description='Card summary, defaults to the title'),
+    'color': fields.String(description="Theme colour, e.g. '#c71212'"),
+    'facts': fields.Raw(description='Object of fact name to value'),
+    'targets': fields.Raw(description="'all' for every enabled team, or a list of team names", default='all'),
+    'topics': fields.List(fields.String, description='Only send to teams subscribed to one of these topics'),
+    'dedup_key': fields.String(description='Repeats of the same key are coalesced'),
+    'priority': fields.String(description='Delivery lane', enum=list(outbox.LANES), default='normal'),
+    'digest': fields.Boolean(description='Hold the message back for the next digest card', default=False),
+})
+batch_model = api.model('Batch', {
+    'messages': fields.List(fields.Nested(message_model), required=True),
+})
+schedule_model = api.inherit('Schedule', message_model, {
+    'name': fields.String(required=True, description='Unique schedule name'),
+    'cron': fields.String(required=True, description="Cron expression, e.g. '0 9 * * 1-5'"),
+})
+
+
+def message_targets(message):
+    """
+    Works out which teams an API message goes to
+
+    :param message: Message from the request body
+    :return: List of notification ids, or None for every enabled team
+    """
+    targets = message.get('targets', 'all')
+    if targets == 'all':
+        target_ids = None
+    elif isinstance(targets, list):
+        found = channels.get_by_name(targets)
+        missing = [name for name in targets if name not in found]
+        if missing:
+            api.abort(400, f"Unknown or disabled teams: {', '.join(map(str, missing))}")
+        target_ids = [entry.id for entry in found.values()]
+    else:
+        api.abort(400, "targets must be 'all' or a list of team names")
+    if message.get('topics'):
+        subscribers = [entry.id for entry in channels.subscribers(message['topics'])]
+        if target_ids is None:
+            target_ids = subscribers
+        else:
+            subscribed = set(subscribers)
+            target_ids = [target_id for target_id in target_ids if target_id in subscribed]
+    return target_ids
+
+
+def message_card(message):
+    """
+    :param message: Message from the request body
+    :return: Card payload dict
+    """
+    if not isinstance(message.get('facts') or {}, dict):
+        api.abort(400, 'facts must be an object of fact name to value')
+    return build_card(message.get('title'), message.get('text'), message.get('summary'), message.get('color'),
+                      message.get('facts'))
+
+
+@ns.route('/batch')
+class NotificationBatch(Resource):
+    @authorize.login_required
+    @ns.expect(batch_model, validate=True)
+    def post(self):
+        """
+        Queues a batch of messages and returns straight away, a worker sends them
+        """
+        messages = []
+        digests = []
+        for message in api.payload['messages']:
+            queued = {'payload': message_card(message), 'targets': message_targets(message)}
+            if message.get('digest'):
+                digests.append(queued)
+                continue
+            queued.update({'dedup_key': message.get('dedup_key'),
+                           'priority': outbox.LANES[message.get('priority') or 'normal']})
+            messages.append(queued)
+        batch_id = uuid.uuid4().hex
+        queued = outbox.enqueue_many(messages, batch_id) if messages else 0
+        digested = scheduler.digest_many(digests) if digests else 0
+        return {'batch_id': batch_id, 'queued': queued, 'digested': digested}, 202
+
+
+@ns.route('/batch/<string:batch_id>')
+class NotificationBatchStatus(Resource):
+    @authorize.login_required
+    def get(self, batch_id):
+        """
+        Shows how many messages of a batch are in each state
+        """
+        status = outbox.batch_status(batch_id)
+        if not status:
+            api.abort(404, 'Unknown batch')
+        return {'batch_id': batch_id, 'status': status}
+
+
+@ns.route('/schedules')
+class ScheduleList(Resource):
+    @authorize.login_required
+    def get(self):
+        """
+        Lists the recurring messages
+        """
+        rows = Schedule.query.with_entities(Schedule.id, Schedule.name, Schedule.cron, Schedule.enabled,
+                                            Schedule.next_run, Schedule.last_run).order_by(Schedule.name)
+        return [{'id': row.id, 'name': row.name, 'cron': row.cron, 'enabled': row.enabled,
+                 'next_run': row.next_run, 'last_run': row.last_run} for row in rows]
+
+    @authorize.login_required
+    @ns.expect(schedule_model, validate=True)
+    def post(self):
+        """
+        Adds a recurring message, the worker queues it every time the cron expression matches
+        """
+        message = api.payload
+        try:
+            # An expression can parse and still never match, e.g. '0 0 31 2 *'
+            scheduler.CronExpression(message['cron']).next_after(time.time())
+        except ValueError as e:
+            api.abort(400, str(e))
+        if Schedule.query.filter(Schedule.name == message['name']).first() is not None:
+            api.abort(409, 'A schedule with that name already exists')
+        schedule_id = scheduler.add_schedule(message['name'], message['cron'], message_card(message),
+                                             message_targets(message),
+                                             outbox.LANES[message.get('priority') or 'normal'])
+        return {'id': schedule_id}, 201
+
+
+@ns.route('/schedules/<int:schedule_id>')
+class ScheduleItem(Resource):
+    @authorize.login_required
+    def delete(self, schedule_id):
+        """
+        Removes a recurring message
+        """
+        if not scheduler.remove_schedule(schedule_id):
+            api.abort(404, 'Unknown schedule')
+        return '', 204
+
+
+ns_listing = api.namespace('listings', path='/', description='Paged notification and user listings')
+
+
+def listing_response(rows, next_after, columns):
+    return {'items': [{column: getattr(row, column) for column in columns} for row in rows], 'next_after': next_after}
+
+
+@ns_listing.route('/notifications')
+class NotificationList(Resource):
+    @authorize.login_required
+    @ns_listing.doc(params={'q': 'Search on team name', 'enabled': '0 or 1', 'after': 'Id to start after',
+                            'limit': 'Page size, at most 200'})
+    def get(self):
+        """
+        Lists notifications a page at a time
+        """
+        rows, next_after = notification_listing(request.args)
+        return listing_response(rows, next_after, ('id', 'name', 'channel_type', 'enabled', 'disabled_reason',
+                                                   'updated'))
+
+
+@ns_listing.route('/users')
+class UserList(Resource):
+    @authorize.login_required
+    @ns_listing.doc(params={'q': 'Search on username or email', 'admin': '0 or 1', 'disabled': '0 or 1',
+                            'after': 'Id to start after', 'limit': 'Page size, at most 200'})
+    def get(self):
+        """
+        Lists users a page at a time, admins only
+        """
+        if g.user.admin != 1:
+            api.abort(403, 'Only Admins can do that!')
+        rows, next_after = user_listing(request.args)
+        return listing_response(rows, next_after, ('id', 'username', 'email', 'firstname', 'lastname', 'admin',
+                                                   'disabled'))
@@ -0,0 +1,35 @@
+from app.extensions import ma
+from app.models import User, Notifications
+
+
+class UserSchema(ma.SQLAlchemyAutoSchema):
+    class Meta:
+        model = User
+        include_relationships = True
+        load_instance = True
+
+    id = ma.auto_field()
+    username = ma.auto_field()
+    password = ma.auto_field()
+    firstname = ma.auto_field()
+    lastname = ma.auto_field()
+    email = ma.auto_field()
+    disabled = ma.auto_field()
+    admin = ma.auto_field()
+    token = ma.auto_field()
+
+
+class NotificationsSchema(ma.SQLAlchemyAutoSchema):
+    class Meta:
+        model = Notifications
+        include_relationships = True
+        load_instance = True
+
+    id = ma.auto_field()
+    name = ma.auto_field()
+    channel_url = ma.auto_field()
+    channel_type = ma.auto_field()
+    enabled = ma.auto_field()
+    disabled_reason = ma.auto_field()
+    created = ma.auto_field()
+    updated = ma.auto_field()
@@ -0,0 +1,103 @@
+import argparse
+import json
+import time
+
+from bench.mock_smtp import MockSMTP
+from bench.mock_teams import MockTeams
+from bench.run import percentile
+from lib.notifications import default_card
+from lib.notifications.adapters import TeamsAdapter, JSONWebhookAdapter, SlackAdapter, EmailAdapter
+from lib.notifications.cards import CardTemplate
+from lib.notifications.fanout import FanOut
+from lib.notifications.registry import ChannelEntry
+from lib.notifications.smtp import SMTPPool, EmailSender
+from lib.notifications.transport import Transport
+
+# Each adapter is measured on its own: a fresh transport or SMTP pool and a fan out without rate limits, retries or
+# circuit breaker, so the numbers are the adapter and its destination and nothing else. No database is needed.
+ADAPTERS = {
+    'teams': lambda args: TeamsAdapter(Transport(pool_size=args.pool_size)),
+    'webhook': lambda args: JSONWebhookAdapter(Transport(pool_size=args.pool_size)),
+    'slack': lambda args: SlackAdapter(Transport(pool_size=args.pool_size)),
+    'email': lambda args: EmailAdapter(EmailSender(SMTPPool(*args.smtp, size=args.pool_size), 'bench@localhost')),
+}
+
+
+def channels(channel_type, count, base_url):
+    """
+    :param channel_type: Adapter being measured
+    :param count: Number of channels
+    :param base_url: Mock webhook server URL
+    :return: List of ChannelEntry
+    """
+    if channel_type == 'email':
+        return [ChannelEntry(n, f"Bench Team {n}", f"team{n}@bench.local", channel_type) for n in range(count)]
+    return [ChannelEntry(n, f"Bench Team {n}", f"{base_url}/{channel_type}/{n}", channel_type) for n in range(count)]
+
+
+def measure(channel_type, adapter, teams, fanout):
+    """
+    Times one broadcast through a single adapter
+
+    :param channel_type: Adapter name
+    :param adapter: Adapter instance
+    :param teams: Channels to send to
+    :param fanout: FanOut used for delivery
+    :return: Dict of measurements
+    """
+    template = CardTemplate(default_card())
+    start = time.perf_counter()
+    compiled = adapter.compile(template)
+    converted = time.perf_counter() - start
+    start = time.perf_counter()
+    messages = [adapter.message(team.channel_url, team.name, compiled.render(team), team.id) for team in teams]
+    built = time.perf_counter() - start
+    start = time.perf_counter()
+    results = fanout.broadcast(messages)
+    elapsed = time.perf_counter() - start
+    latencies = [result.elapsed for result in results]
+    return {
+        'adapter': channel_type,
+        'channels': len(teams),
+        'sent': sum(1 for result in results if result.ok),
+        'failed': sum(1 for result in results if not result.ok),
+        'convert_ms': round(converted * 1000, 3),
+        'build_ms': round(built * 1000, 1),
+        'body_bytes': len(messages[0].payload) if messages else 0,
+        'seconds': round(elapsed, 3),
+        'messages_per_sec': round(len(teams) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks each channel adapter in isolation against local mocks")
+    parser.add_argument('--adapter', choices=sorted(ADAPTERS), nargs='+', default=sorted(ADAPTERS))
+    parser.add_argument('--channels', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--latency', type=float, default=0.05, help="mock webhook latency in seconds")
+    parser.add_argument('--smtp-latency', type=float, default=0.01, help="mock SMTP latency per message in seconds")
+    parser.add_argument('--workers', type=int, default=16, help="sends in flight at once")
+    parser.add_argument('--pool-size', type=int, default=32, help="HTTP or SMTP connections per adapter")
+    parser.add_argument('--json', action='store_true', help="print one JSON object per run")
+    args = parser.parse_args()
+
+    webhooks = MockTeams(latency=args.latency)
+    base_url = webhooks.start()
+    mail = MockSMTP(latency=args.smtp_latency)
+    args.smtp = mail.start()
+    fanout = FanOut(max_workers=args.workers, timeout=10)
+    columns = ('adapter', 'channels', 'sent', 'failed', 'convert_ms', 'build_ms', 'body_bytes', 'seconds',
+               'messages_per_sec', 'p50_ms', 'p99_ms')
+    if not args.json:
+        print(' '.join(f"{column:>16}" for column in columns))
+    for name in args.adapter:
+        adapter = ADAPTERS[name](args)
+        for count in args.channels:
+            row = measure(name, adapter, channels(name, count, base_url), fanout)
+            if args.json:
+                print(json.dumps(row))
+            else:
+                print(' '.join(f"{row[column]:>16}" for column in columns))
+    webhooks.shutdown()
+    mail.shutdown()
@@ -0,0 +1,87 @@
+import argparse
+import socketserver
+import threading
+import time
+
+
+class MockSMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Speaks just enough SMTP for smtplib to send mail: every message is accepted and thrown away once its DATA is in,
+    after the server's latency.
+    """
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.reply('220 mock ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip().split(' ', 1)[0].upper()
+            if command == 'EHLO':
+                self.reply('250-mock')
+                self.reply('250 8BITMIME')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                    pass
+                if self.server.latency:
+                    time.sleep(self.server.latency)
+                self.server.count()
+                self.reply('250 OK queued')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            elif command in ('HELO', 'MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.reply('250 OK')
+            else:
+                self.reply('502 Command not implemented')
+
+
+class MockSMTP(socketserver.ThreadingTCPServer):
+    """
+    Local stand in for the mail server
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.01):
+        """
+        :param host: Address to listen on
+        :param port: Port to listen on, 0 picks a free one
+        :param latency: Seconds each message takes
+        """
+        super().__init__((host, port), MockSMTPHandler)
+        self.latency = latency
+        self.messages = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def count(self):
+        with self._lock:
+            self.messages += 1
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    def start(self):
+        """
+        Serves in a background thread
+
+        :return: Tuple of host and port
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.server_address[:2]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a local mock SMTP server")
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--latency', type=float, default=0.01, help="seconds per message")
+    args = parser.parse_args()
+    server = MockSMTP(port=args.port, latency=args.latency)
+    print(f"Mock SMTP server listening on {server.server_address[0]}:{server.server_address[1]}")
+    server.serve_forever()
@@ -0,0 +1,96 @@
+import argparse
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockTeamsHandler(BaseHTTPRequestHandler):
+    """
+    Answers webhook posts the way a Teams connector does: '1' with a 200 on success. The server settings decide how
+    slow it is and how often it fails or throttles.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server.count()
+        if server.latency:
+            time.sleep(server.latency)
+        roll = random.random()
+        if roll < server.throttle_rate:
+            self._reply(429, b'Webhook message delivery failed with error: Microsoft Teams endpoint returned HTTP '
+                             b'error 429', {'Retry-After': str(server.retry_after)})
+        elif roll < server.throttle_rate + server.error_rate:
+            self._reply(500, b'Internal Server Error')
+        else:
+            self._reply(200, b'1')
+
+    def _reply(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockTeams(ThreadingHTTPServer):
+    """
+    Local stand in for the Teams webhook host
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.05, error_rate=0.0, throttle_rate=0.0, retry_after=1):
+        """
+        :param host: Address to listen on
+        :param port: Port to listen on, 0 picks a free one
+        :param latency: Seconds each request takes
+        :param error_rate: Fraction of requests answered with a 500
+        :param throttle_rate: Fraction of requests answered with a 429
+        :param retry_after: Retry-After seconds sent with a 429
+        """
+        super().__init__((host, port), MockTeamsHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """
+        Serves in a background thread
+
+        :return: Base URL of the server
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a local mock Teams webhook server")
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds per request")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds sent with a 429")
+    args = parser.parse_args()
+    server = MockTeams(port=args.port, latency=args.latency, error_rate=args.error_rate,
+                       throttle_rate=args.throttle_rate, retry_after=args.retry_after)
+    print(f"Mock Teams webhook listening on {server.url}/webhook/<n>")
+    server.serve_forever()
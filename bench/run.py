@@ -0,0 +1,96 @@
+import argparse
+import json
+import os
+import resource
+import time
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:////tmp/teamsnotify-bench.db')
+
+from app import create_app, init_db
+from bench.mock_teams import MockTeams
+from bench.seed import seed
+from lib.notifications import default_message, outbox
+from lib.notifications.worker import OutboxWorker
+
+
+def run_default_message():
+    return default_message()
+
+
+def run_outbox():
+    default_message(enqueue=True)
+    worker = OutboxWorker()
+    results = []
+    for row in outbox.claim(worker.worker_id, worker.batch_size, worker.lease_seconds):
+        results.extend(worker.deliver(row))
+    return results
+
+
+SCENARIOS = {
+    'default_message': run_default_message,
+    'outbox': run_outbox,
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def measure(name, scenario, count):
+    """
+    Times one broadcast
+
+    :param name: Scenario name
+    :param scenario: Function performing the broadcast and returning its DeliveryResults
+    :param count: Number of channels seeded
+    :return: Dict of measurements
+    """
+    start = time.perf_counter()
+    results = scenario()
+    elapsed = time.perf_counter() - start
+    latencies = [result.elapsed for result in results]
+    return {
+        'scenario': name,
+        'channels': count,
+        'sent': sum(1 for result in results if result.ok),
+        'failed': sum(1 for result in results if not result.ok),
+        'seconds': round(elapsed, 3),
+        'messages_per_sec': round(count / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks broadcasts against a local mock Teams server")
+    parser.add_argument('--channels', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), nargs='+', default=sorted(SCENARIOS))
+    parser.add_argument('--latency', type=float, default=0.05, help="mock webhook latency in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--json', action='store_true', help="print one JSON object per run")
+    args = parser.parse_args()
+
+    app = create_app(web=False)
+    init_db(app)
+    app.app_context().push()
+    server = MockTeams(latency=args.latency, error_rate=args.error_rate, throttle_rate=args.throttle_rate)
+    base_url = server.start()
+    columns = ('scenario', 'channels', 'sent', 'failed', 'seconds', 'messages_per_sec', 'p50_ms', 'p99_ms',
+               'peak_rss_mb')
+    if not args.json:
+        print(' '.join(f"{column:>16}" for column in columns))
+    for count in args.channels:
+        seed(count, base_url)
+        for name in args.scenario:
+            row = measure(name, SCENARIOS[name], count)
+            if args.json:
+                print(json.dumps(row))
+            else:
+                print(' '.join(f"{row[column]:>16}" for column in columns))
+    server.shutdown()
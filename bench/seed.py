@@ -0,0 +1,34 @@
+import argparse
+from datetime import datetime
+
+from app import db, create_app, init_db
+from app.models import Notifications
+from lib.notifications.registry import channels
+
+
+def seed(count, base_url):
+    """
+    Replaces every row in the Notifications table with count enabled benchmark channels
+
+    :param count: Number of channels
+    :param base_url: Base URL of the mock Teams server
+    """
+    Notifications.query.delete()
+    today = str(datetime.today().date())
+    db.session.bulk_insert_mappings(Notifications, [
+        {'name': f"bench-{number}", 'channel_url': f"{base_url}/webhook/{number}", 'enabled': 1, 'created': today,
+         'updated': today} for number in range(count)])
+    channels.changed()
+    db.session.commit()
+    channels.invalidate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fills the Notifications table with benchmark channels")
+    parser.add_argument('count', type=int)
+    parser.add_argument('--base-url', default='http://127.0.0.1:8099')
+    args = parser.parse_args()
+    app = create_app(web=False)
+    init_db(app)
+    with app.app_context():
+        seed(args.count, args.base_url)
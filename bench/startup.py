@@ -0,0 +1,68 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Each entry point is started in a fresh interpreter, the way gunicorn, the worker and cron start it
+ENTRY_POINTS = {
+    'web': "from app import create_app; create_app()",
+    'worker': "from app import create_app; from lib.notifications.worker import OutboxWorker; create_app(web=False)",
+    'sender': "from app import create_app; from lib.notifications import default_message; create_app(web=False)",
+}
+
+TIMED = "import time; start = time.perf_counter(); {code}; print(time.perf_counter() - start)"
+
+
+def cold_start(code, runs):
+    """
+    :param code: Python code starting the entry point
+    :param runs: Number of fresh interpreters to time
+    :return: List of seconds taken
+    """
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', TIMED.format(code=code)], capture_output=True, text=True,
+                                check=True).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return timings
+
+
+def slowest_imports(code, count):
+    """
+    :param code: Python code starting the entry point
+    :param count: Number of modules to return
+    :return: List of (module, milliseconds) for the top level imports that took longest, including their imports
+    """
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+                            check=True).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit() and not name.startswith('  '):
+            imports.append((name.strip(), int(cumulative) / 1000))
+    return sorted(imports, key=lambda item: item[1], reverse=True)[:count]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures how long each entry point takes to start")
+    parser.add_argument('--entry', choices=sorted(ENTRY_POINTS), nargs='+', default=sorted(ENTRY_POINTS))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--imports', type=int, default=0, help="also list the N slowest top level imports")
+    parser.add_argument('--json', action='store_true', help="print one JSON object per entry point")
+    args = parser.parse_args()
+
+    for name in args.entry:
+        timings = cold_start(ENTRY_POINTS[name], args.runs)
+        row = {'entry': name, 'runs': args.runs, 'median_ms': round(statistics.median(timings) * 1000, 1),
+               'min_ms': round(min(timings) * 1000, 1)}
+        if args.imports:
+            row['slowest_imports'] = slowest_imports(ENTRY_POINTS[name], args.imports)
+        if args.json:
+            print(json.dumps(row))
+            continue
+        print(f"{name:>8} median {row['median_ms']:>8} ms   min {row['min_ms']:>8} ms")
+        for module, milliseconds in row.get('slowest_imports', []):
+            print(f"{'':>10}{module:<40}{milliseconds:>8.1f} ms")
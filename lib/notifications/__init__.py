@@ -1,6 +1,25 @@
+import time
+import uuid
+from datetime import datetime
+
 import pymsteams
 
-from app.models import Notifications
+from app import db
+from app.config import Config
+from app.models import Notifications, RateLimitBucket
+from lib.notifications.fanout import FanOut
+from lib.notifications.transport import Transport
+from lib.notifications.retry import RetryPolicy
+from lib.notifications.ratelimit import RateLimiter, MemoryBackend, DatabaseBackend
+from lib.notifications import outbox
+from lib.notifications.registry import channels
+from lib.notifications.cards import CardTemplate, templates
+from lib.notifications import metrics
+from lib.notifications.breaker import CircuitBreaker
+from lib.notifications.deliveries import delivery_log
+from lib.notifications.smtp import SMTPPool, EmailSender
+from lib.notifications.adapters import AdapterRegistry, TeamsAdapter, JSONWebhookAdapter, SlackAdapter, \
+    EmailAdapter, SendMessage, SendEmail
 import logging as logger
 
 
@@ -9,59 +28,195 @@ class NotificationEngine:
     Notifications Engine Class. By default all we look for here is teams that are enabled to get notifications. You
     can add additional columns (boolean 0=disabled/1=enabled) to the Notifications model and have teams be able to
     configure which specific notifications they'd like.
+
+    Enabled teams come from the in memory channel registry rather than the database, see registry.ChannelRegistry.
     """
     def __init__(self):
-        self.notifications = Notifications.query.filter()
+        self.registry = channels
 
     def get_enabled(self):
         """
-        Gets all entries from the database for enabled teams
+        Gets all enabled teams
+
+        :return: Enabled teams
+        """
+        return self.registry.enabled()
 
+    def get_by_ids(self, ids):
+        """
+        Gets the enabled teams out of a list of notification ids
+
+        :param ids: Notification ids
         :return: Enabled teams
         """
-        team_query = self.notifications.filter(Notifications.enabled == 1).all()
-        return team_query
+        return self.registry.get(ids)
+
+    def get_subscribers(self, topics):
+        """
+        Gets the enabled teams subscribed to any of the given topics
+
+        :param topics: Topic name or list of topic names
+        :return: Enabled teams
+        """
+        if isinstance(topics, str):
+            topics = [topics]
+        return self.registry.subscribers(topics)
 
 
 notification = NotificationEngine()
 
 
-class SendMessage:
+transport = Transport(pool_size=Config.NOTIFY_POOL_SIZE, http2=Config.NOTIFY_HTTP2)
+retry_policy = RetryPolicy(base=Config.NOTIFY_RETRY_BASE, cap=Config.NOTIFY_RETRY_CAP,
+                           max_attempts=Config.NOTIFY_RETRY_ATTEMPTS)
+if Config.NOTIFY_RATE_BACKEND == 'database':
+    rate_backend = DatabaseBackend(db, RateLimitBucket)
+else:
+    rate_backend = MemoryBackend()
+rate_limiter = RateLimiter(rate=Config.NOTIFY_RATE_LIMIT, burst=Config.NOTIFY_RATE_BURST,
+                           global_rate=Config.NOTIFY_GLOBAL_RATE_LIMIT, backend=rate_backend)
+breaker = CircuitBreaker(threshold=Config.NOTIFY_BREAKER_THRESHOLD,
+                         cooldown=Config.NOTIFY_BREAKER_COOLDOWN,
+                         disable_after=Config.NOTIFY_BREAKER_DISABLE_AFTER)
+fanout = FanOut(max_workers=Config.NOTIFY_MAX_WORKERS, timeout=Config.NOTIFY_SEND_TIMEOUT,
+                policy=retry_policy, retry_budget=Config.NOTIFY_RETRY_BUDGET, limiter=rate_limiter,
+                breaker=breaker)
+smtp_pool = SMTPPool(Config.MAIL_SERVER, Config.MAIL_PORT, use_tls=Config.MAIL_USE_TLS, username=Config.MAIL_USERNAME,
+                     password=Config.MAIL_PASSWORD, size=Config.NOTIFY_SMTP_POOL_SIZE,
+                     timeout=Config.NOTIFY_SMTP_TIMEOUT, max_idle=Config.NOTIFY_SMTP_MAX_IDLE)
+email_sender = EmailSender(smtp_pool, Config.MAIL_DEFAULT_SENDER)
+# One adapter per Notifications.channel_type, register_adapter adds more
+adapters = AdapterRegistry(default='teams')
+adapters.register(TeamsAdapter(transport))
+adapters.register(JSONWebhookAdapter(transport))
+adapters.register(SlackAdapter(transport))
+adapters.register(EmailAdapter(email_sender))
+register_adapter = adapters.register
+
+metrics.registry.register(metrics.Gauge(
+    'teamsnotify_outbox_depth', 'Messages waiting in the outbox, by lane', outbox.lane_depths, 'lane'))
+metrics.registry.register(metrics.Gauge(
+    'teamsnotify_connections_opened', 'Connections opened by the transport', lambda: transport.stats.opened))
+metrics.registry.register(metrics.Gauge(
+    'teamsnotify_connections_reused', 'Requests sent on an already open connection', lambda: transport.stats.reused))
+
+
+def broadcast(payload, teams=None, first_attempt=1, priority=outbox.NORMAL, message_id=None, retry_budget=None):
     """
-    This is the class that actually sends the message to teams.
+    Sends a card payload to every team at the same time, whatever kind of channel each team has. Every message goes
+    through the same pipeline: the card is converted once per channel type by that type's adapter and compiled, only
+    the per team fields are filled in for each team, then the fan out delivers them all under the same rate limits,
+    retries and circuit breaker. Deliveries that still need retrying once the retry budget is spent are put back on
+    the outbox for later, deliveries that have run out of attempts go to the dead letters, both in a single insert.
+    Every result is written to the delivery log.
+
+    :param payload: Card payload dict or CardTemplate
+    :param teams: Optional list of teams, defaults to every enabled team
+    :param first_attempt: Attempt number of the first send, for messages that have been tried before
+    :param priority: Outbox lane used for deferred retries and dead letters
+    :param message_id: Optional id the deliveries are logged under, defaults to a new one
+    :param retry_budget: Optional seconds this broadcast may keep retrying, defaults to NOTIFY_RETRY_BUDGET. Callers
+        that can't be held up, like the outbox worker, pass 0 so every retry goes back on the outbox.
+    :return: List of DeliveryResult, one per team
     """
-    def __init__(self, teams_url):
-        """
-        Basic Initialization
-        :param teams_url: Teams Webhook URL
-        """
-        self.message = pymsteams.connectorcard(teams_url)
+    template = payload if isinstance(payload, CardTemplate) else CardTemplate(payload)
+    if teams is None:
+        start = time.perf_counter()
+        teams = notification.get_enabled()
+        metrics.stage_latency.observe(time.perf_counter() - start, 'lookup')
+    start = time.perf_counter()
+    compiled = {}
+    messages = []
+    for team in teams:
+        adapter = adapters.get(team.channel_type)
+        if adapter.channel_type not in compiled:
+            compiled[adapter.channel_type] = adapter.compile(template)
+        body = compiled[adapter.channel_type].render(team)
+        messages.append(adapter.message(team.channel_url, team.name, body, team.id))
+    metrics.stage_latency.observe(time.perf_counter() - start, 'build')
+    results = fanout.broadcast(messages, first_attempt, retry_budget)
+    delivery_log.record(message_id or uuid.uuid4().hex, results)
+    # A channel whose circuit is open was skipped, not tried, so it goes back on the queue for when the circuit lets a
+    # probe through rather than to the dead letters
+    outbox.hand_back(template.source, [result for result in results if not result.ok], priority)
+    disabled = breaker.pop_disabled()
+    if disabled:
+        channel_ids = {result.url: result.channel_id for result in results}
+        for url, reason in disabled:
+            disable_channel(channel_ids.get(url), url, reason)
+    return results
 
-    def send(self):
-        """
-        Sends a message to the teams channel webhook URL
-        """
-        try:
-            self.message.send()
-        except Exception as e:
-            logger.error(f"Caught exception sending message: {e}")
+
+def disable_channel(channel_id, url, reason):
+    """
+    Switches off a team whose webhook keeps failing and records why, so an admin can see it on the notifications page
+
+    :param channel_id: Notification id, if known
+    :param url: Channel webhook URL
+    :param reason: Why the team was disabled
+    """
+    logger.warning(f"Disabling notifications for {url}: {reason}")
+    match = Notifications.id == channel_id if channel_id is not None else Notifications.channel_url == url
+    Notifications.query.filter(match).update(
+        {Notifications.enabled: 0, Notifications.disabled_reason: reason[:500],
+         Notifications.updated: str(datetime.today().date())}, synchronize_session=False)
+    version = channels.changed()
+    db.session.commit()
+    if channel_id is not None:
+        channels.discard(channel_id, version)
+    else:
+        channels.invalidate()
+
+
+def send_email(to, subject, body, priority=outbox.CRITICAL):
+    """
+    Queues an email for the outbox worker, so the caller never waits on the mail server. The worker sends the emails
+    of a batch over one pooled SMTP connection and retries temporary failures.
+
+    :param to: List of addresses
+    :param subject: Subject line
+    :param body: Plain text body
+    :param priority: Outbox lane, password resets and the like go in the critical lane by default
+    :return: Outbox id
+    """
+    return outbox.enqueue({'to': list(to), 'subject': subject, 'body': body}, priority=priority, kind=outbox.EMAIL)
 
 
-def default_message():
+def default_card():
     """
     This is the default message format, you can use this to create as many different types as you want.
     You can also pass variables in and have those show up in the message. You can use fstrings for simplicity.
+    Per team fields such as {{team_name}} are filled in for each team when the card is sent.
+
+    :return: Card payload dict
     """
-    teams = notification.get_enabled()
-    for team in teams:
-        sendMessage = SendMessage(team.teams_channel_url)
-        myTeamsMessage = sendMessage.message
-        myMessageSection = pymsteams.cardsection()
-        myMessageSection.activityTitle("This is your Title")
-        myMessageSection.activitySubtitle(f"<h3>This is your subtitle</h3>")
-        myMessageSection.addFact("Fact 1", "This is what a fact looks like")
-        myMessageSection.activityImage('<imgurl>')
-        myTeamsMessage.color('#c71212')
-        myTeamsMessage.summary("Summary")
-        myTeamsMessage.addSection(myMessageSection)
-        sendMessage.send()
+    myTeamsMessage = pymsteams.connectorcard(None)
+    myMessageSection = pymsteams.cardsection()
+    myMessageSection.activityTitle("This is your Title")
+    myMessageSection.activitySubtitle(f"<h3>This is your subtitle</h3>")
+    myMessageSection.addFact("Fact 1", "This is what a fact looks like")
+    myMessageSection.activityImage('<imgurl>')
+    myTeamsMessage.color('#c71212')
+    myTeamsMessage.summary("Summary")
+    myTeamsMessage.addSection(myMessageSection)
+    return myTeamsMessage.payload
+
+
+def default_message(enqueue=False, dedup_key=None, priority=outbox.NORMAL, topics=None):
+    """
+    Sends the default message to all enabled teams. The card is built and compiled the first time it is used and
+    reused after that.
+
+    :param enqueue: Put the message on the outbox for a worker to send instead of sending it now
+    :param dedup_key: Optional key, repeats of the same key within the dedup window are coalesced. Repeats are only
+        coalesced on the outbox, so a message with a dedup key is always enqueued.
+    :param priority: Outbox lane when enqueued, outbox.CRITICAL, outbox.NORMAL or outbox.BULK
+    :param topics: Optional topic name or list of topic names, only teams subscribed to them get the message
+    :return: Outbox id when enqueued, otherwise a list of DeliveryResult, one per team
+    """
+    template = templates.get('default', default_card)
+    teams = notification.get_subscribers(topics) if topics is not None else None
+    if enqueue or dedup_key is not None:
+        targets = [team.id for team in teams] if teams is not None else None
+        return outbox.enqueue(template.source, targets, dedup_key=dedup_key, priority=priority)
+    return broadcast(template, teams, priority=priority)
@@ -0,0 +1,262 @@
+import json
+import re
+import time
+from abc import ABC, abstractmethod
+
+from lib.notifications import metrics
+from lib.notifications.cards import CardTemplate
+from lib.notifications.fanout import DeliveryResult
+from lib.notifications.retry import parse_retry_after
+import logging as logger
+
+
+_TAGS = re.compile(r'<[^>]+>')
+
+
+def record_send(name, elapsed, result):
+    metrics.send_latency.observe(elapsed, name)
+    metrics.stage_latency.observe(elapsed, 'http')
+    metrics.sends.inc(name, result)
+
+
+def _plain(value):
+    return _TAGS.sub('', str(value)) if value is not None else None
+
+
+def card_fields(card):
+    """
+    Pulls the parts every destination understands out of a card
+
+    :param card: Card payload dict
+    :return: Dict of title, summary, text, color and facts (list of name/value dicts)
+    """
+    sections = card.get('sections') or []
+    title = card.get('title') or next((section['activityTitle'] for section in sections
+                                       if section.get('activityTitle')), None)
+    texts = [card['text']] if card.get('text') else []
+    facts = []
+    for section in sections:
+        for key in ('activitySubtitle', 'text'):
+            if section.get(key):
+                texts.append(section[key])
+        facts.extend({'name': _plain(fact.get('name')), 'value': _plain(fact.get('value'))}
+                     for fact in section.get('facts') or [])
+    return {'title': _plain(title), 'summary': _plain(card.get('summary')) or _plain(title),
+            'text': '\n'.join(_plain(text) for text in texts), 'color': card.get('themeColor'), 'facts': facts}
+
+
+class SendMessage:
+    """
+    Posts one rendered body to one webhook. Messages are posted through the shared transport so sends reuse pooled
+    connections.
+    """
+    def __init__(self, url, name=None, payload=None, channel_id=None, transport=None):
+        """
+        :param url: Webhook URL
+        :param name: Team name, used when reporting the result
+        :param payload: Body to post, as a dict or rendered JSON bytes
+        :param channel_id: Notification id of the team, used when reporting the result
+        :param transport: Transport the body is posted through
+        """
+        self.url = url
+        self.name = name
+        self.payload = payload
+        self.channel_id = channel_id
+        self.transport = transport
+
+    def send(self, timeout=None):
+        """
+        Sends the message to the webhook URL
+
+        :param timeout: Optional timeout in seconds for this send
+        :return: DeliveryResult
+        """
+        start = time.monotonic()
+        try:
+            response = self.transport.post(self.url, self.payload, timeout=timeout)
+        except Exception as e:
+            logger.error(f"Caught exception sending message: {e}")
+            elapsed = time.monotonic() - start
+            record_send(self.name, elapsed, 'failure')
+            return DeliveryResult(self.name, self.url, False, str(e), elapsed, channel_id=self.channel_id)
+        elapsed = time.monotonic() - start
+        if not 200 <= response.status_code < 300:
+            record_send(self.name, elapsed, 'failure')
+            logger.error(f"Webhook returned {response.status_code} for {self.name}: {response.text}")
+            return DeliveryResult(self.name, self.url, False, response.text, elapsed, response.status_code,
+                                  parse_retry_after(response.headers.get('Retry-After')), self.channel_id)
+        record_send(self.name, elapsed, 'success')
+        return DeliveryResult(self.name, self.url, True, elapsed=elapsed, status=response.status_code,
+                              channel_id=self.channel_id)
+
+
+class SendEmail:
+    """
+    Emails one rendered body to the addresses of an email channel. It looks the same as SendMessage to the fan out.
+    """
+    def __init__(self, addresses, name=None, payload=None, channel_id=None, sender=None):
+        """
+        :param addresses: Comma separated email addresses
+        :param name: Team name, used when reporting the result
+        :param payload: Dict or rendered JSON bytes of 'subject' and 'body'
+        :param channel_id: Notification id of the team, used when reporting the result
+        :param sender: EmailSender the email goes out through
+        """
+        self.name = name
+        self.channel_id = channel_id
+        self.to = [address.strip() for address in addresses.split(',') if address.strip()]
+        self.payload = payload
+        self.sender = sender
+
+    @property
+    def url(self):
+        return f"mailto:{','.join(self.to)}"
+
+    def send(self, timeout=None):
+        """
+        Sends the email through the pooled SMTP connections
+
+        :param timeout: Unused, the SMTP pool has its own timeout
+        :return: DeliveryResult
+        """
+        start = time.monotonic()
+        try:
+            email = json.loads(self.payload) if isinstance(self.payload, (bytes, str)) else self.payload
+            result = self.sender.send(self.to, email['subject'], email['body'])
+        except Exception as e:
+            logger.error(f"Caught exception sending email: {e}")
+            elapsed = time.monotonic() - start
+            record_send(self.name, elapsed, 'failure')
+            return DeliveryResult(self.name, self.url, False, str(e), elapsed, channel_id=self.channel_id)
+        result.channel = self.name
+        result.channel_id = self.channel_id
+        record_send(self.name, result.elapsed, 'success' if result.ok else 'failure')
+        return result
+
+
+class Adapter(ABC):
+    """
+    A kind of destination. convert turns a card into the body the destination takes, which happens once per
+    broadcast, and message wraps the body rendered for one channel so the fan out can send it. Everything else
+    (dedup, per team fields, rate limiting, retries, circuit breaking and concurrency) is shared by every adapter.
+    """
+    channel_type = None
+
+    def convert(self, card):
+        """
+        :param card: Card payload dict, string values may hold per team fields such as {{team_name}}
+        :return: Body dict for this destination
+        """
+        return card
+
+    def compile(self, template):
+        """
+        :param template: CardTemplate of the card
+        :return: CardTemplate of the body for this destination
+        """
+        return CardTemplate(self.convert(template.source))
+
+    @abstractmethod
+    def message(self, address, name, body, channel_id):
+        """
+        :param address: Notifications.channel_url
+        :param name: Team name
+        :param body: Body rendered for the team
+        :param channel_id: Notification id
+        :return: Message with url, name, channel_id and send(timeout)
+        """
+
+
+class WebhookAdapter(Adapter):
+    """
+    Destinations that take a JSON post to a webhook URL, sent through the shared transport
+    """
+    def __init__(self, transport):
+        self.transport = transport
+
+    def message(self, address, name, body, channel_id):
+        return SendMessage(address, name, body, channel_id, self.transport)
+
+
+class TeamsAdapter(WebhookAdapter):
+    """
+    Microsoft Teams incoming webhooks take the card as it is
+    """
+    channel_type = 'teams'
+
+    def compile(self, template):
+        return template
+
+
+class JSONWebhookAdapter(WebhookAdapter):
+    """
+    Any webhook that takes JSON. The body is a flat document with the card alongside for consumers that want it.
+    """
+    channel_type = 'webhook'
+
+    def convert(self, card):
+        body = card_fields(card)
+        body['card'] = card
+        return body
+
+
+class SlackAdapter(WebhookAdapter):
+    """
+    Slack style incoming webhooks, which Mattermost and Rocket.Chat also accept
+    """
+    channel_type = 'slack'
+
+    def convert(self, card):
+        fields = card_fields(card)
+        attachment = {'fallback': fields['summary'] or '', 'title': fields['title'], 'text': fields['text'],
+                      'fields': [{'title': fact['name'], 'value': fact['value'], 'short': True}
+                                 for fact in fields['facts']]}
+        if fields['color']:
+            attachment['color'] = fields['color'] if fields['color'].startswith('#') else f"#{fields['color']}"
+        return {'text': fields['summary'] or '', 'attachments': [attachment]}
+
+
+class EmailAdapter(Adapter):
+    """
+    Email channels, channel_url holds comma separated addresses. The card becomes a plain text email.
+    """
+    channel_type = 'email'
+
+    def __init__(self, sender):
+        self.sender = sender
+
+    def convert(self, card):
+        fields = card_fields(card)
+        # Header values can't hold line breaks
+        subject = ' '.join((fields['summary'] or 'Notification').split())
+        lines = [fields['title']] if fields['title'] and ' '.join(fields['title'].split()) != subject else []
+        if fields['text']:
+            lines.append(fields['text'])
+        lines.extend(f"{fact['name']}: {fact['value']}" for fact in fields['facts'])
+        return {'subject': subject, 'body': '\n'.join(lines) + '\n'}
+
+    def message(self, address, name, body, channel_id):
+        return SendEmail(address, name, body, channel_id, self.sender)
+
+
+class AdapterRegistry:
+    """
+    Adapters by channel_type. Rows with an unknown channel_type are sent with the default adapter.
+    """
+    def __init__(self, default='teams'):
+        self.default = default
+        self._adapters = {}
+
+    def register(self, adapter):
+        """
+        :param adapter: Adapter instance, replaces any adapter with the same channel_type
+        :return: The adapter
+        """
+        self._adapters[adapter.channel_type] = adapter
+        return adapter
+
+    def get(self, channel_type):
+        return self._adapters.get(channel_type) or self._adapters[self.default]
+
+    def types(self):
+        return list(self._adapters)
@@ -0,0 +1,123 @@
+import threading
+import time
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class _Circuit:
+    __slots__ = ('state', 'failures', 'opened_at', 'probing', 'last_error')
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.last_error = None
+
+
+class CircuitBreaker:
+    """
+    One circuit per channel URL. After threshold failures in a row the circuit opens and sends to that channel are
+    skipped straight away instead of waiting on a dead webhook to time out. Once the cooldown has passed a single
+    probe is let through, success closes the circuit again and failure keeps it open for another cooldown.
+
+    When disable_after is set, a channel that has failed that many times in a row is reported by pop_disabled so the
+    caller can switch it off. Throttling (429) says nothing about whether a webhook is alive so it isn't counted.
+    """
+    def __init__(self, threshold=5, cooldown=60, disable_after=None):
+        """
+        :param threshold: Failures in a row that open the circuit
+        :param cooldown: Seconds an open circuit waits before letting a probe through
+        :param disable_after: Optional failures in a row after which the channel should be disabled
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.disable_after = disable_after
+        self._circuits = {}
+        self._disabled = []
+        self._lock = threading.Lock()
+
+    def allow(self, url):
+        """
+        :param url: Channel webhook URL
+        :return: True if a message may be sent to the channel now
+        """
+        circuit = self._circuits.get(url)
+        if circuit is None or circuit.state == CLOSED:
+            return True
+        with self._lock:
+            if circuit.state == OPEN and time.monotonic() - circuit.opened_at >= self.cooldown:
+                circuit.state = HALF_OPEN
+                circuit.probing = False
+            if circuit.state == HALF_OPEN and not circuit.probing:
+                circuit.probing = True
+                return True
+            return circuit.state == CLOSED
+
+    def release(self, url):
+        """
+        Gives back the probe of a half open circuit when the message allow let through isn't sent after all, for
+        instance because it is held back by the rate limiter, so the next message can probe instead
+
+        :param url: Channel webhook URL
+        """
+        circuit = self._circuits.get(url)
+        if circuit is not None and circuit.state == HALF_OPEN:
+            circuit.probing = False
+
+    def retry_in(self, url):
+        """
+        :param url: Channel webhook URL
+        :return: Seconds until the channel's circuit lets a probe through, a full cooldown while a probe is out
+        """
+        circuit = self._circuits.get(url)
+        if circuit is None or circuit.state == CLOSED:
+            return 0
+        return max(circuit.opened_at + self.cooldown - time.monotonic(), 0) or self.cooldown
+
+    def record(self, result):
+        """
+        Updates the channel's circuit with the outcome of a send
+
+        :param result: DeliveryResult
+        """
+        if result.status == 429:
+            circuit = self._circuits.get(result.url)
+            if circuit is not None:
+                circuit.probing = False
+            return
+        with self._lock:
+            circuit = self._circuits.get(result.url)
+            if result.ok:
+                if circuit is not None:
+                    del self._circuits[result.url]
+                return
+            if circuit is None:
+                circuit = self._circuits[result.url] = _Circuit()
+            circuit.failures += 1
+            circuit.last_error = result.error
+            circuit.probing = False
+            if circuit.state == HALF_OPEN or circuit.failures >= self.threshold:
+                circuit.state = OPEN
+                circuit.opened_at = time.monotonic()
+            if self.disable_after and circuit.failures == self.disable_after:
+                self._disabled.append((result.url, f"{circuit.failures} failures in a row, last: {result.error}"))
+
+    def state(self, url):
+        """
+        :param url: Channel webhook URL
+        :return: CLOSED, OPEN or HALF_OPEN
+        """
+        circuit = self._circuits.get(url)
+        return circuit.state if circuit is not None else CLOSED
+
+    def pop_disabled(self):
+        """
+        :return: List of (url, reason) for channels that crossed disable_after since the last call
+        """
+        with self._lock:
+            disabled, self._disabled = self._disabled, []
+        return disabled
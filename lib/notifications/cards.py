@@ -0,0 +1,103 @@
+import json
+import re
+import threading
+
+import pymsteams
+
+
+FIELD = re.compile(r'\{\{(\w+)\}\}')
+
+
+class CardTemplate:
+    """
+    A card payload compiled once to JSON. String values in the payload may contain per team fields such as
+    {{team_name}} or {{team_id}}. The JSON is split around those fields when the template is built, so rendering it for
+    a team only joins the precompiled pieces with the escaped field values. A template without fields hands every team
+    the exact same bytes.
+    """
+    def __init__(self, source):
+        """
+        :param source: Card payload dict (pymsteams connectorcard.payload)
+        """
+        self.source = source
+        text = json.dumps(source, separators=(',', ':'))
+        pieces = FIELD.split(text)
+        self._static = pieces[0::2]
+        self.fields = tuple(pieces[1::2])
+        self._bytes = text.encode('utf-8') if not self.fields else None
+
+    def render(self, team=None, values=None):
+        """
+        Renders the payload for one team
+
+        :param team: Team the payload is for, provides {{team_name}} and {{team_id}}
+        :param values: Optional dict of extra field values
+        :return: JSON payload bytes
+        """
+        if self._bytes is not None:
+            return self._bytes
+        context = dict(values or {})
+        if team is not None:
+            context.setdefault('team_name', team.name)
+            context.setdefault('team_id', team.id)
+        parts = [self._static[0]]
+        for field, static in zip(self.fields, self._static[1:]):
+            # json.dumps escapes the value for use inside the string it is substituted into
+            parts.append(json.dumps(str(context.get(field, '')))[1:-1])
+            parts.append(static)
+        return ''.join(parts).encode('utf-8')
+
+
+def build_card(title=None, text=None, summary=None, color=None, facts=None):
+    """
+    Builds a simple card payload from plain values, for messages that come in from outside (e.g. the API)
+
+    :param title: Section title
+    :param text: Section text
+    :param summary: Card summary, defaults to the title
+    :param color: Theme colour, e.g. '#c71212'
+    :param facts: Optional dict of fact name to value
+    :return: Card payload dict
+    """
+    card = pymsteams.connectorcard(None)
+    section = pymsteams.cardsection()
+    if title:
+        section.activityTitle(title)
+    if text:
+        section.text(text)
+    for name, value in (facts or {}).items():
+        section.addFact(name, value)
+    if color:
+        card.color(color)
+    card.summary(summary or title or text or 'Notification')
+    card.addSection(section)
+    return card.payload
+
+
+class TemplateCache:
+    """
+    Named, compiled templates. Each card is built and compiled the first time it is used and reused after that.
+    """
+    def __init__(self):
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, build):
+        """
+        :param name: Template name
+        :param build: Function returning the card payload dict, only called the first time
+        :return: CardTemplate
+        """
+        template = self._templates.get(name)
+        if template is None:
+            with self._lock:
+                template = self._templates.get(name)
+                if template is None:
+                    template = self._templates[name] = CardTemplate(build())
+        return template
+
+    def clear(self):
+        self._templates.clear()
+
+
+templates = TemplateCache()
@@ -0,0 +1,21 @@
+import copy
+
+
+def merge(payload, count, window):
+    """
+    Marks a card as standing in for several identical messages, e.g. "(×37 in last 5 min)"
+
+    :param payload: Card payload dict
+    :param count: Number of messages the card stands in for
+    :param window: Coalescing window in seconds
+    :return: New card payload dict
+    """
+    period = f"{int(window // 60)} min" if window >= 60 else f"{int(window)} sec"
+    note = f"×{count} in last {period}"
+    payload = copy.deepcopy(payload)
+    payload['summary'] = f"{payload['summary']} ({note})" if payload.get('summary') else note
+    sections = payload.get('sections')
+    if sections:
+        title = sections[0].get('activityTitle')
+        sections[0]['activityTitle'] = f"{title} ({note})" if title else note
+    return payload
@@ -0,0 +1,160 @@
+import atexit
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import current_app, has_app_context
+
+from app import db
+from app.config import Config
+from app.models import Delivery, DeliveryRollup
+import logging as logger
+
+
+SENT = 'sent'
+FAILED = 'failed'
+DEFERRED = 'deferred'
+# Not attempted because the channel's circuit was open
+SKIPPED = 'skipped'
+STATUSES = (SENT, FAILED, DEFERRED, SKIPPED)
+
+DAY = 86400
+
+
+def result_status(result):
+    """
+    :param result: DeliveryResult
+    :return: SENT, FAILED, DEFERRED or SKIPPED
+    """
+    if result.ok:
+        return SENT
+    if result.skipped:
+        return SKIPPED
+    return DEFERRED if result.deferred else FAILED
+
+
+class DeliveryLog:
+    """
+    Keeps a history of every delivery. Results are buffered and written with one bulk insert once flush_size rows
+    have built up or flush_interval seconds after the first of them was recorded, so a broadcast to thousands of teams
+    is a handful of transactions rather than one per send. Whatever is still buffered is written when the process
+    exits. Rows are written on a connection of their own, so a flush never commits the caller's session.
+    """
+    def __init__(self, flush_size=500, flush_interval=5):
+        """
+        :param flush_size: Buffered rows that trigger a write
+        :param flush_interval: Seconds after which buffered rows are written, by a timer if nothing else is recorded
+        """
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+        self._app = None
+        self._timer = None
+
+    def record(self, message_id, results):
+        """
+        :param message_id: Id of the message the results belong to
+        :param results: List of DeliveryResult
+        """
+        if self._app is None and has_app_context():
+            self._app = current_app._get_current_object()
+        now = time.time()
+        rows = [{'message_id': message_id, 'channel_id': result.channel_id, 'status': result_status(result),
+                 'http_status': result.status, 'latency': result.elapsed, 'attempts': result.attempts,
+                 'error': result.error[:500] if result.error else None, 'created': now} for result in results]
+        with self._lock:
+            self._buffer.extend(rows)
+            due = len(self._buffer) >= self.flush_size or time.monotonic() - self._flushed >= self.flush_interval
+            if not due and self._timer is None and self._app is not None:
+                # Nothing else may be recorded for a while in a web process, so the rows don't wait on the next one
+                self._timer = threading.Timer(self.flush_interval, self._flush_later)
+                self._timer.daemon = True
+                self._timer.start()
+        if due:
+            self.flush()
+
+    def _flush_later(self):
+        self._timer = None
+        with self._app.app_context():
+            self.flush()
+
+    def flush(self):
+        """
+        Writes every buffered row
+
+        :return: Number of rows written
+        """
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            self._flushed = time.monotonic()
+        if not rows:
+            return 0
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(Delivery.__table__.insert(), rows)
+        except Exception as e:
+            logger.error(f"Caught exception writing {len(rows)} deliveries: {e}")
+            return 0
+        return len(rows)
+
+    def flush_at_exit(self):
+        """
+        Writes whatever is left when the process exits, in the app the rows were recorded in since its context is
+        usually gone by then
+        """
+        if self._buffer and self._app is not None:
+            with self._app.app_context():
+                self.flush()
+
+
+def _day(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d')
+
+
+def compact(retention_days=30):
+    """
+    Rolls deliveries older than retention_days up into one row per day, team and status, then deletes them. Each
+    day is rolled up in its own transaction, if another worker is compacting the same day the totals won't match
+    the rows deleted and the day is left to that worker.
+
+    :param retention_days: Days of individual deliveries to keep
+    :return: Number of deliveries rolled up
+    """
+    cutoff = (time.time() - retention_days * DAY) // DAY * DAY
+    oldest = db.session.query(db.func.min(Delivery.created)).filter(Delivery.created < cutoff).scalar()
+    if oldest is None:
+        return 0
+    compacted = 0
+    start = oldest // DAY * DAY
+    while start < cutoff:
+        end = start + DAY
+        in_day = (Delivery.created >= start, Delivery.created < end)
+        totals = db.session.query(Delivery.channel_id, Delivery.status, db.func.count(Delivery.id),
+                                  db.func.sum(Delivery.latency)).filter(*in_day) \
+            .group_by(Delivery.channel_id, Delivery.status).all()
+        expected = sum(count for _, _, count, _ in totals)
+        if expected:
+            day = _day(start)
+            for channel_id, status, count, latency in totals:
+                rollup = DeliveryRollup.query.get((day, channel_id or 0, status))
+                if rollup is None:
+                    rollup = DeliveryRollup(day=day, channel_id=channel_id or 0, status=status, count=0,
+                                            total_latency=0.0)
+                    db.session.add(rollup)
+                rollup.count += count
+                rollup.total_latency += latency or 0.0
+            deleted = Delivery.query.filter(*in_day).delete(synchronize_session=False)
+            if deleted != expected:
+                db.session.rollback()
+            else:
+                db.session.commit()
+                compacted += deleted
+        start = end
+    return compacted
+
+
+delivery_log = DeliveryLog(flush_size=Config.NOTIFY_DELIVERY_FLUSH_SIZE,
+                           flush_interval=Config.NOTIFY_DELIVERY_FLUSH_INTERVAL)
+atexit.register(delivery_log.flush_at_exit)
@@ -0,0 +1,178 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from lib.notifications import metrics
+import logging as logger
+
+
+class DeliveryResult:
+    """
+    Outcome of sending one message to one channel. A broadcast returns one of these per channel so callers can see
+    exactly which webhooks failed and how long each one took. When retry_at is set the delivery has not given up yet,
+    it should be tried again at that time. A skipped delivery was never attempted because the channel's circuit is
+    open, its retry_at is when the circuit lets a probe through.
+    """
+    __slots__ = ('channel', 'url', 'ok', 'error', 'elapsed', 'status', 'retry_after', 'channel_id', 'attempts',
+                 'retry_at', 'skipped')
+
+    def __init__(self, channel, url, ok, error=None, elapsed=0.0, status=None, retry_after=None, channel_id=None):
+        self.channel = channel
+        self.url = url
+        self.ok = ok
+        self.error = error
+        self.elapsed = elapsed
+        self.status = status
+        self.retry_after = retry_after
+        self.channel_id = channel_id
+        self.attempts = 1
+        self.retry_at = None
+        self.skipped = False
+
+    @property
+    def deferred(self):
+        return self.retry_at is not None
+
+    def __repr__(self):
+        return f"DeliveryResult('{self.channel}', ok={self.ok}, status={self.status}, attempts={self.attempts})"
+
+
+class FanOut:
+    """
+    Delivers a message to many channels at once using a bounded thread pool. Sending to a Teams webhook is almost
+    entirely waiting on the network, so running the sends side by side makes a broadcast take about as long as the
+    slowest webhook instead of the sum of all of them.
+
+    Failed sends are retried according to the retry policy, and sends to a channel that is over its rate limit are
+    held back until it has tokens again. Both are scheduled on a timer rather than slept on, so a throttled channel
+    never holds up the others. Anything that can't go out within the retry budget is handed back to the caller as a
+    deferred result. Channels whose circuit breaker is open are skipped without being sent to and handed back as
+    deferred until the circuit lets a probe through.
+    """
+    def __init__(self, max_workers=16, timeout=10, policy=None, retry_budget=30, limiter=None, breaker=None):
+        """
+        :param max_workers: Maximum number of webhooks being sent to at the same time
+        :param timeout: Per-send timeout in seconds
+        :param policy: Optional RetryPolicy, failures are not retried without one
+        :param retry_budget: Seconds a broadcast may keep retrying before deferring the rest
+        :param limiter: Optional RateLimiter consulted before every send
+        :param breaker: Optional CircuitBreaker consulted before every send
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.policy = policy
+        self.retry_budget = retry_budget
+        self.limiter = limiter
+        self.breaker = breaker
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        """
+        The send threads, shared by every broadcast so a long running worker keeps a fixed set of them. Like the
+        transport it is rebuilt after a fork.
+        """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='teams-send')
+                    self._pid = os.getpid()
+        return self._pool
+
+    def broadcast(self, messages, first_attempt=1, retry_budget=None):
+        """
+        Sends every message concurrently and waits for all of them to finish or be deferred
+
+        :param messages: Iterable of SendMessage instances
+        :param first_attempt: Attempt number of the first send, for messages that have been tried before
+        :param retry_budget: Optional retry budget in seconds for this broadcast, 0 defers every retry
+        :return: List of DeliveryResult, one per channel
+        """
+        messages = list(messages)
+        if not messages:
+            return []
+        results = []
+        deadline = time.monotonic() + (self.retry_budget if retry_budget is None else retry_budget)
+        scheduled = []
+        sequence = itertools.count()
+        pool = self.pool
+        running = {}
+
+        def allow(message, attempt):
+            if self.breaker and not self.breaker.allow(message.url):
+                result = DeliveryResult(message.name, message.url, False, 'Circuit open',
+                                        channel_id=message.channel_id)
+                result.attempts = attempt - 1
+                result.skipped = True
+                result.retry_at = time.time() + self.breaker.retry_in(message.url)
+                results.append(result)
+                return False
+            return True
+
+        def submit(message, attempt, wait_for=None, admitted=False):
+            # A message is admitted by the breaker once, a send held back by the rate limiter isn't asked again
+            if not admitted and not allow(message, attempt):
+                return
+            if wait_for is None:
+                wait_for = self.limiter.acquire(message.url) if self.limiter else 0
+            if not wait_for:
+                running[pool.submit(message.send, self.timeout)] = (message, attempt)
+                return
+            if self.breaker:
+                # It may hold the probe of a half open circuit, which has to be given back since it isn't sent now
+                self.breaker.release(message.url)
+            if time.monotonic() + wait_for > deadline:
+                result = DeliveryResult(message.name, message.url, False, 'Rate limited',
+                                        channel_id=message.channel_id)
+                result.attempts = attempt - 1
+                result.retry_at = time.time() + wait_for
+                results.append(result)
+            else:
+                metrics.retries.inc('rate_limit')
+                heapq.heappush(scheduled, (time.monotonic() + wait_for, next(sequence), message, attempt, True))
+
+        # The first sends take their rate limit tokens all at once, retries take them one by one
+        allowed = [message for message in messages if allow(message, first_attempt)]
+        if self.limiter:
+            waits = self.limiter.acquire_many([message.url for message in allowed])
+        else:
+            waits = [0] * len(allowed)
+        for message, wait_for in zip(allowed, waits):
+            submit(message, first_attempt, wait_for, admitted=True)
+        while running or scheduled:
+            now = time.monotonic()
+            while scheduled and scheduled[0][0] <= now:
+                _, _, message, attempt, admitted = heapq.heappop(scheduled)
+                submit(message, attempt, admitted=admitted)
+            timeout = max(scheduled[0][0] - now, 0) if scheduled else None
+            if not running:
+                if timeout:
+                    time.sleep(timeout)
+                continue
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                message, attempt = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # A message that raises instead of returning a result fails on its own, not the whole broadcast
+                    logger.error(f"Caught exception sending to {message.name}: {e}")
+                    result = DeliveryResult(message.name, message.url, False, str(e), channel_id=message.channel_id)
+                result.attempts = attempt
+                if self.breaker:
+                    self.breaker.record(result)
+                delay = None if result.ok or self.policy is None else self.policy.delay(result, attempt)
+                if delay is None:
+                    results.append(result)
+                elif time.monotonic() + delay > deadline:
+                    result.retry_at = time.time() + delay
+                    results.append(result)
+                else:
+                    metrics.retries.inc('error')
+                    heapq.heappush(scheduled, (time.monotonic() + delay, next(sequence), message, attempt + 1, False))
+        return results
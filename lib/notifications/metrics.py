@@ -0,0 +1,231 @@
+import threading
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging as logger
+
+
+class _Sharded:
+    """
+    Each thread updates its own shard of a metric and shards are only summed when the metrics are scraped, so the
+    send path never waits on a lock. The lock is only taken the first time a thread touches a metric. Shards of threads
+    that have finished are folded into one when scraped, so short lived sender threads don't pile up.
+    """
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._prune()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _prune(self):
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                _fold(self._retired, shard)
+        self._shards = live
+
+    def _snapshots(self):
+        with self._lock:
+            self._prune()
+            snapshots = [dict(self._retired)]
+            live = list(self._shards)
+        return snapshots + [dict(shard) for _, shard in live]
+
+
+def _fold(into, shard):
+    for labels, value in shard.items():
+        if isinstance(value, list):
+            total = into.setdefault(labels, [0] * len(value))
+            for index, item in enumerate(value):
+                total[index] += item
+        else:
+            into[labels] = into.get(labels, 0) + value
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter(_Sharded):
+    """
+    A count that only goes up, e.g. messages sent
+    """
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__()
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self):
+        totals = {}
+        for shard in self._snapshots():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram(_Sharded):
+    """
+    Counts observations into buckets, e.g. send latency
+    """
+    default_buckets = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=None):
+        super().__init__()
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets or self.default_buckets)
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            # One slot per bucket, then the sum, then the count
+            series = shard[labels] = [0] * (len(self.buckets) + 2)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        totals = {}
+        for shard in self._snapshots():
+            for labels, series in shard.items():
+                total = totals.setdefault(labels, [0] * len(series))
+                for index, value in enumerate(series):
+                    total[index] += value
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ('le',)
+        for labels, series in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """
+    A value worked out when the metrics are scraped, e.g. the outbox depth. With a labelname the function returns a
+    dict of label value to value.
+    """
+    def __init__(self, name, documentation, function, labelname=None):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.labelname = labelname
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        if self.labelname is None:
+            lines.append(f"{self.name} {self.function()}")
+        else:
+            for label, value in sorted(self.function().items()):
+                lines.append(f"{self.name}{_labels((self.labelname,), (label,))} {value}")
+        return lines
+
+
+class Registry:
+    """
+    Every metric exposed on /metrics. Processes without the web app, like the outbox worker, expose them with serve.
+    """
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        :return: Every metric in the Prometheus text format
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='0.0.0.0', context=None):
+        """
+        Serves the metrics on /metrics from a background thread
+
+        :param port: Port to listen on
+        :param host: Address to listen on
+        :param context: Optional function returning a context manager each scrape runs in, e.g. app.app_context for
+            gauges that query the database
+        :return: The HTTP server
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                try:
+                    with context() if context is not None else nullcontext():
+                        body = registry.render().encode('utf-8')
+                except Exception as e:
+                    logger.error(f"Caught exception rendering metrics: {e}")
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+        return server
+
+
+registry = Registry()
+send_latency = registry.register(Histogram(
+    'teamsnotify_send_seconds', 'Time taken to send a message to a channel', ('channel',)))
+sends = registry.register(Counter(
+    'teamsnotify_sends_total', 'Messages sent, by channel and result', ('channel', 'result')))
+retries = registry.register(Counter(
+    'teamsnotify_retries_total', 'Sends scheduled for another attempt', ('reason',)))
+stage_latency = registry.register(Histogram(
+    'teamsnotify_stage_seconds', 'Time spent in each stage of a broadcast', ('stage',)))
+lane_latency = registry.register(Histogram(
+    'teamsnotify_lane_seconds', 'Time from enqueue to delivery, by priority lane', ('lane',),
+    buckets=(.1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300, 900)))
@@ -0,0 +1,331 @@
+import json
+import time
+
+from sqlalchemy import or_, and_
+
+from app import db
+from app.models import Outbox
+from lib.notifications.dedup import merge
+
+
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+DEAD = 'dead'
+SUPPRESSED = 'suppressed'
+# Held back as a repeat of a message with the same dedup key until its window closes, see suppress_repeats
+REPEAT = 'repeat'
+
+# Priority lanes, lower numbers are drained first
+CRITICAL = 0
+NORMAL = 1
+BULK = 2
+LANES = {'critical': CRITICAL, 'normal': NORMAL, 'bulk': BULK}
+LANE_NAMES = {number: name for name, number in LANES.items()}
+
+# What a message is: a card broadcast to teams, or an email to a list of addresses
+CARD = 'card'
+EMAIL = 'email'
+
+
+def enqueue(payload, targets=None, delay=0, attempts=0, dedup_key=None, priority=NORMAL, kind=CARD):
+    """
+    Adds a message to the outbox. This is a single insert no matter how many teams the message goes to, the worker
+    works out the recipients when it sends.
+
+    :param payload: Card payload dict (pymsteams connectorcard.payload)
+    :param targets: Optional list of notification ids, defaults to every enabled team
+    :param delay: Seconds to wait before the message may be sent
+    :param attempts: Number of delivery attempts already made, for retries
+    :param dedup_key: Optional key, repeats of the same key within the dedup window are coalesced by the worker
+    :param priority: Lane the message goes in, CRITICAL, NORMAL or BULK
+    :param kind: CARD, or EMAIL for a payload of 'to', 'subject' and 'body'
+    :return: Outbox id
+    """
+    now = time.time()
+    row = Outbox(payload=json.dumps(payload), targets=json.dumps(targets) if targets is not None else None,
+                 status=PENDING,
+                 attempts=attempts, available_at=now + max(delay, 0), dedup_key=dedup_key, priority=priority,
+                 kind=kind, created=now, updated=now)
+    db.session.add(row)
+    db.session.commit()
+    return row.id
+
+
+def enqueue_many(messages, batch_id=None, commit=True):
+    """
+    Adds several messages to the outbox in a single transaction
+
+    :param messages: Iterable of dicts with 'payload' and optionally 'targets', 'dedup_key' and 'priority'
+    :param batch_id: Optional id shared by every message, used to look the batch up later
+    :param commit: Commit straight away, pass False to commit along with the caller's own changes
+    :return: Number of messages queued
+    """
+    now = time.time()
+    rows = [{'payload': json.dumps(message['payload']),
+             'targets': json.dumps(message['targets']) if message.get('targets') is not None else None,
+             'dedup_key': message.get('dedup_key'), 'priority': message.get('priority', NORMAL),
+             'batch_id': batch_id, 'status': PENDING, 'attempts': 0, 'available_at': now, 'kind': CARD,
+             'created': now, 'updated': now} for message in messages]
+    db.session.bulk_insert_mappings(Outbox, rows)
+    if commit:
+        db.session.commit()
+    return len(rows)
+
+
+def batch_status(batch_id):
+    """
+    :param batch_id: Batch id given to enqueue_many
+    :return: Dict of status to number of messages
+    """
+    rows = db.session.query(Outbox.status, db.func.count(Outbox.id)).filter(Outbox.batch_id == batch_id) \
+        .group_by(Outbox.status)
+    return {status: count for status, count in rows}
+
+
+def _claimable(now):
+    return or_(and_(Outbox.status == PENDING, Outbox.available_at <= now),
+               and_(Outbox.status == SENDING, Outbox.lease_expires < now))
+
+
+def _claimable_ids(now, priority, limit):
+    if limit <= 0:
+        return []
+    return [row.id for row in db.session.query(Outbox.id).filter(Outbox.priority == priority, _claimable(now))
+            .order_by(Outbox.id).limit(limit)]
+
+
+def _pick(now, batch_size, weights):
+    """
+    Picks which messages go in the next batch. Critical messages always go first and may take the whole batch, the
+    rest of the batch is shared between the other lanes by weight, and any share a lane can't use is handed on to
+    the next lane, so bulk traffic keeps moving without ever delaying a critical alert.
+    """
+    ids = _claimable_ids(now, CRITICAL, batch_size)
+    remaining = batch_size - len(ids)
+    lanes = [lane for lane in (NORMAL, BULK) if weights.get(LANE_NAMES[lane])]
+    total = sum(weights[LANE_NAMES[lane]] for lane in lanes)
+    picked = {}
+    for lane in lanes:
+        share = max(remaining * weights[LANE_NAMES[lane]] // total, 1)
+        picked[lane] = _claimable_ids(now, lane, min(share, remaining))
+    spare = remaining - sum(len(lane_ids) for lane_ids in picked.values())
+    for lane in lanes:
+        if spare <= 0:
+            break
+        extra = [row_id for row_id in _claimable_ids(now, lane, len(picked[lane]) + spare)
+                 if row_id not in picked[lane]]
+        picked[lane].extend(extra)
+        spare -= len(extra)
+    for lane in lanes:
+        ids.extend(picked[lane])
+    return ids
+
+
+def claim(worker_id, batch_size=50, lease_seconds=60, weights=None):
+    """
+    Claims a batch of messages for a worker. Rows are leased rather than locked, if the worker dies the lease runs
+    out and another worker picks the messages up again. The batch is made up from the priority lanes as described
+    in _pick and comes back in the order it should be sent, critical first. Each message should be renewed right
+    before it is sent, see renew.
+
+    :param worker_id: Unique id of the claiming worker
+    :param batch_size: Maximum number of messages to claim
+    :param lease_seconds: How long the worker has to start on the batch, and to send each message once renewed
+    :param weights: Dict of lane name to weight for the non critical lanes, e.g. {'normal': 4, 'bulk': 1}
+    :return: List of claimed Outbox rows
+    """
+    now = time.time()
+    ids = _pick(now, batch_size, weights or {'normal': 4, 'bulk': 1})
+    if not ids:
+        return []
+    # The update re-checks the claim condition so two workers racing for the same rows can't both win
+    Outbox.query.filter(Outbox.id.in_(ids), _claimable(now)).update(
+        {Outbox.status: SENDING, Outbox.lease_owner: worker_id, Outbox.lease_expires: now + lease_seconds,
+         Outbox.updated: now}, synchronize_session=False)
+    db.session.commit()
+    return Outbox.query.filter(Outbox.id.in_(ids), Outbox.lease_owner == worker_id, Outbox.status == SENDING) \
+        .order_by(Outbox.priority, Outbox.id).all()
+
+
+def suppress_repeats(rows, worker_id, window):
+    """
+    Coalesces repeats across every worker. A claimed message with a dedup key is a repeat when a message with the
+    same key that was queued before it, less than window seconds earlier, was not a repeat itself. Repeats are held
+    back as REPEAT until that message's window closes and then go out as one card, see close_windows. Which messages
+    are repeats only depends on the table, so workers claiming messages with the same key at once agree on it.
+
+    :param rows: Claimed Outbox rows, in the order they were claimed
+    :param worker_id: Id of the worker that claimed them
+    :param window: Dedup window in seconds
+    :return: The rows that should be sent
+    """
+    send = []
+    held = []
+    for row in rows:
+        if row.dedup_key is None:
+            send.append(row)
+            continue
+        opened = db.session.query(Outbox.created).filter(
+            Outbox.dedup_key == row.dedup_key, Outbox.id < row.id, Outbox.status.notin_([REPEAT, SUPPRESSED]),
+            Outbox.created > row.created - window).order_by(Outbox.id.desc()).first()
+        if opened is None:
+            send.append(row)
+        else:
+            held.append((row.id, opened.created + window))
+    if held:
+        now = time.time()
+        for row_id, closes in held:
+            Outbox.query.filter(Outbox.id == row_id, Outbox.lease_owner == worker_id, Outbox.status == SENDING).update(
+                {Outbox.status: REPEAT, Outbox.available_at: closes, Outbox.lease_owner: None,
+                 Outbox.lease_expires: None, Outbox.updated: now}, synchronize_session=False)
+        db.session.commit()
+    return send
+
+
+def close_windows(window):
+    """
+    Queues one card for every closed dedup window that held back repeats, carrying the number of repeats. A window is
+    taken by moving its repeats from REPEAT to SUPPRESSED in one conditional update, only the worker whose update
+    matched every repeat queues the card.
+
+    :param window: Dedup window in seconds, only used to word the card
+    :return: Number of cards queued
+    """
+    now = time.time()
+    repeats = Outbox.query.with_entities(Outbox.id, Outbox.dedup_key, Outbox.available_at, Outbox.payload,
+                                         Outbox.targets, Outbox.priority) \
+        .filter(Outbox.status == REPEAT, Outbox.available_at <= now).order_by(Outbox.id).all()
+    windows = {}
+    for repeat in repeats:
+        windows.setdefault((repeat.dedup_key, repeat.available_at), []).append(repeat)
+    queued = 0
+    for held in windows.values():
+        ids = [repeat.id for repeat in held]
+        taken = Outbox.query.filter(Outbox.id.in_(ids), Outbox.status == REPEAT).update(
+            {Outbox.status: SUPPRESSED, Outbox.updated: now}, synchronize_session=False)
+        if taken != len(ids):
+            db.session.rollback()
+            continue
+        last = held[-1]
+        db.session.add(Outbox(payload=json.dumps(merge(json.loads(last.payload), len(ids), window)),
+                              targets=last.targets, status=PENDING, attempts=0, available_at=now,
+                              priority=last.priority, kind=CARD, created=now, updated=now))
+        db.session.commit()
+        queued += 1
+    return queued
+
+
+def renew(row_id, worker_id, lease_seconds=60):
+    """
+    Gives a worker a fresh lease on a message it claimed. Workers renew each message just before sending it, if the
+    lease ran out while earlier messages of the batch were being sent and another worker has taken the message over,
+    nothing is updated and the message is left to that worker.
+
+    :param row_id: Outbox id
+    :param worker_id: Id of the worker that claimed the message
+    :param lease_seconds: How long the worker has to send the message
+    :return: True if the worker still holds the message
+    """
+    now = time.time()
+    renewed = Outbox.query.filter(Outbox.id == row_id, Outbox.lease_owner == worker_id, Outbox.status == SENDING) \
+        .update({Outbox.lease_expires: now + lease_seconds, Outbox.updated: now}, synchronize_session=False)
+    db.session.commit()
+    return renewed == 1
+
+
+def _release(row_id, worker_id, values):
+    match = [Outbox.id == row_id]
+    if worker_id is not None:
+        match += [Outbox.lease_owner == worker_id, Outbox.status == SENDING]
+    values.update({Outbox.lease_owner: None, Outbox.lease_expires: None, Outbox.updated: time.time()})
+    released = Outbox.query.filter(*match).update(values, synchronize_session=False)
+    db.session.commit()
+    return released == 1
+
+
+def complete(row, error=None, status=None, worker_id=None):
+    """
+    Marks a claimed message as sent, or as failed when an error is given
+
+    :param row: Claimed Outbox row
+    :param error: Optional error description
+    :param status: Optional status overriding sent/failed
+    :param worker_id: Optional id of the claiming worker, the message is only updated while the worker holds it
+    :return: True if the message was updated
+    """
+    return _release(row.id, worker_id, {Outbox.status: status or (FAILED if error else SENT),
+                                        Outbox.last_error: error})
+
+
+def retry(row, delay, error, worker_id=None):
+    """
+    Puts a claimed message back on the queue to be tried again later
+
+    :param row: Claimed Outbox row
+    :param delay: Seconds to wait before the next attempt
+    :param error: Error of the failed attempt
+    :param worker_id: Optional id of the claiming worker, the message is only updated while the worker holds it
+    :return: True if the message was updated
+    """
+    return _release(row.id, worker_id, {Outbox.status: PENDING, Outbox.attempts: Outbox.attempts + 1,
+                                        Outbox.available_at: time.time() + max(delay, 0), Outbox.last_error: error})
+
+
+def hand_back(payload, results, priority=NORMAL):
+    """
+    Stores the deliveries of a broadcast that didn't go out in one insert: deferred ones go back on the queue for
+    when they may be retried, ones that have run out of attempts become dead letters
+
+    :param payload: Card payload dict
+    :param results: List of DeliveryResult that were deferred or failed
+    :param priority: Lane the messages go in
+    :return: Number of messages stored
+    """
+    now = time.time()
+    source = json.dumps(payload)
+    rows = [{'payload': source, 'targets': json.dumps([result.channel_id]),
+             'status': PENDING if result.deferred else DEAD, 'attempts': result.attempts,
+             'available_at': max(result.retry_at, now) if result.deferred else None,
+             'last_error': None if result.deferred else result.error, 'priority': priority, 'kind': CARD,
+             'created': now, 'updated': now} for result in results]
+    if rows:
+        db.session.bulk_insert_mappings(Outbox, rows)
+        db.session.commit()
+    return len(rows)
+
+
+def dead_letters(limit=50):
+    """
+    :param limit: Most messages returned
+    :return: List of dead or failed Outbox rows, newest first
+    """
+    return Outbox.query.filter(Outbox.status.in_([DEAD, FAILED])).order_by(Outbox.id.desc()).limit(limit).all()
+
+
+def requeue(outbox_id):
+    """
+    Puts a dead or failed message back on the queue with a fresh set of attempts
+
+    :param outbox_id: Outbox id
+    :return: True if the message was dead or failed and is queued again
+    """
+    now = time.time()
+    requeued = Outbox.query.filter(Outbox.id == outbox_id, Outbox.status.in_([DEAD, FAILED])).update(
+        {Outbox.status: PENDING, Outbox.attempts: 0, Outbox.available_at: now, Outbox.last_error: None,
+         Outbox.updated: now}, synchronize_session=False)
+    db.session.commit()
+    return requeued == 1
+
+
+def lane_depths():
+    """
+    :return: Dict of lane name to number of messages waiting to be sent
+    """
+    rows = db.session.query(Outbox.priority, db.func.count(Outbox.id)) \
+        .filter(Outbox.status.in_([PENDING, SENDING])).group_by(Outbox.priority)
+    depths = {name: 0 for name in LANES}
+    for priority, count in rows:
+        depths[LANE_NAMES.get(priority, 'normal')] += count
+    return depths
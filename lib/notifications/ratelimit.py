@@ -0,0 +1,223 @@
+import threading
+import time
+
+from sqlalchemy import and_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+
+
+GLOBAL_KEY = '*'
+
+
+def _refill(tokens, updated, rate, burst, now):
+    return min(float(burst), tokens + (now - updated) * rate)
+
+
+class MemoryBackend:
+    """
+    Keeps buckets in this process only. Fine for a single worker, use DatabaseBackend when several processes send.
+    """
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        """
+        Takes tokens from a bucket if there are enough of them
+
+        :param key: Bucket key
+        :param rate: Tokens added per second
+        :param burst: Bucket size
+        :param cost: Tokens to take, negative to give tokens back
+        :return: Seconds until the tokens would be available, 0 if they were taken
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (float(burst), now))
+            tokens = _refill(tokens, updated, rate, burst, now)
+            if tokens < cost:
+                self._buckets[key] = (tokens, now)
+                return (cost - tokens) / rate
+            # Capped after taking, a refund can't fill the bucket past its size
+            self._buckets[key] = (min(tokens - cost, float(burst)), now)
+            return 0
+
+    def take_many(self, keys, rate, burst, cost=1):
+        """
+        :param keys: List of bucket keys
+        :param rate: Tokens added per second
+        :param burst: Bucket size
+        :param cost: Tokens to take per key, negative to give tokens back
+        :return: List of seconds until the tokens would be available, one per key, 0 if they were taken
+        """
+        return [self.take(key, rate, burst, cost) for key in keys]
+
+
+class DatabaseBackend:
+    """
+    Keeps buckets in the rate_limit_buckets table so every gunicorn and outbox worker shares the same limits. Updates
+    are compare-and-set on a version column, so no database locks are held between reading and writing a bucket.
+    Buckets are read and written on a connection of their own, never the caller's session, and take_many takes the
+    tokens for a whole broadcast in one transaction.
+    """
+    def __init__(self, db, model, max_conflicts=5):
+        """
+        :param db: Flask-SQLAlchemy instance
+        :param model: RateLimitBucket model
+        :param max_conflicts: How many times to retry when another process updated a bucket at the same time
+        """
+        self.db = db
+        self.table = model.__table__
+        self.max_conflicts = max_conflicts
+
+    def take(self, key, rate, burst, cost=1):
+        """
+        Takes tokens from a bucket if there are enough of them
+
+        :param key: Bucket key
+        :param rate: Tokens added per second
+        :param burst: Bucket size
+        :param cost: Tokens to take, negative to give tokens back
+        :return: Seconds until the tokens would be available, 0 if they were taken
+        """
+        return self.take_many([key], rate, burst, cost)[0]
+
+    def _insert_missing(self):
+        # Buckets another process created first are left as they are
+        dialect = self.db.engine.dialect.name
+        if dialect == 'postgresql':
+            return postgresql.insert(self.table).on_conflict_do_nothing(index_elements=[self.table.c.key])
+        if dialect == 'sqlite':
+            return self.table.insert().prefix_with('OR IGNORE')
+        if dialect in ('mysql', 'mariadb'):
+            return self.table.insert().prefix_with('IGNORE')
+        return None
+
+    def _create(self, keys, burst):
+        now = time.time()
+        rows = [{'key': key, 'tokens': float(burst), 'updated': now, 'version': 0} for key in keys]
+        statement = self._insert_missing()
+        if statement is not None:
+            with self.db.engine.begin() as connection:
+                connection.execute(statement.values(rows))
+            return
+        for row in rows:
+            try:
+                with self.db.engine.begin() as connection:
+                    connection.execute(self.table.insert().values(**row))
+            except IntegrityError:
+                # Another process created it first
+                pass
+
+    def take_many(self, keys, rate, burst, cost=1):
+        """
+        Takes tokens from several buckets in one transaction. A key that appears more than once takes its tokens once
+        per appearance, keys that are short of tokens are told how long to wait in turn.
+
+        :param keys: List of bucket keys
+        :param rate: Tokens added per second
+        :param burst: Bucket size
+        :param cost: Tokens to take per key, negative to give tokens back
+        :return: List of seconds until the tokens would be available, one per key, 0 if they were taken
+        """
+        table = self.table
+        waits = [cost / rate] * len(keys)
+        pending = {}
+        for index, key in enumerate(keys):
+            pending.setdefault(key, []).append(index)
+        # New buckets are created on the way, so allow one more round for them
+        for _ in range(self.max_conflicts + 1):
+            if not pending:
+                break
+            conflicted = {}
+            missing = []
+            with self.db.engine.begin() as connection:
+                selected = connection.execute(table.select().where(table.c.key.in_(list(pending))))
+                rows = {row.key: row for row in selected}
+                now = time.time()
+                for key, indexes in pending.items():
+                    row = rows.get(key)
+                    if row is None:
+                        missing.append(key)
+                        conflicted[key] = indexes
+                        continue
+                    tokens = _refill(row.tokens, row.updated, rate, burst, now)
+                    short = 0.0
+                    for index in indexes:
+                        if tokens >= cost:
+                            tokens -= cost
+                            waits[index] = 0
+                        else:
+                            short += cost
+                            waits[index] = (short - tokens) / rate
+                    tokens = min(tokens, float(burst))
+                    changed = connection.execute(table.update().where(
+                        and_(table.c.key == key, table.c.version == row.version)).values(
+                        tokens=tokens, updated=now, version=row.version + 1)).rowcount
+                    if not changed:
+                        conflicted[key] = indexes
+            if missing:
+                self._create(missing, burst)
+            pending = conflicted
+        for indexes in pending.values():
+            for index in indexes:
+                waits[index] = cost / rate
+        return waits
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter keyed by channel URL, with an optional global cap across all channels. The sender asks
+    it before every delivery and defers the send when the channel has no tokens left, instead of sending anyway and
+    getting throttled by Teams.
+    """
+    def __init__(self, rate, burst, global_rate=None, global_burst=None, backend=None):
+        """
+        :param rate: Messages per second allowed per channel
+        :param burst: Messages a channel may receive back to back
+        :param global_rate: Optional messages per second across every channel
+        :param global_burst: Burst size for the global cap, defaults to the global rate
+        :param backend: Bucket storage, defaults to MemoryBackend
+        """
+        self.rate = rate
+        self.burst = burst
+        self.global_rate = global_rate
+        self.global_burst = global_burst or global_rate
+        self.backend = backend or MemoryBackend()
+
+    def acquire(self, url):
+        """
+        Takes a token for a channel
+
+        :param url: Channel webhook URL
+        :return: Seconds to wait before trying again, 0 if the message may be sent now
+        """
+        if self.global_rate:
+            wait = self.backend.take(GLOBAL_KEY, self.global_rate, self.global_burst)
+            if wait:
+                return wait
+        wait = self.backend.take(url, self.rate, self.burst)
+        if wait and self.global_rate:
+            self.backend.take(GLOBAL_KEY, self.global_rate, self.global_burst, cost=-1)
+        return wait
+
+    def acquire_many(self, urls):
+        """
+        Takes a token for each of several channels at once, which is a single transaction per bucket table rather
+        than one per message when the buckets are in the database
+
+        :param urls: List of channel webhook URLs
+        :return: List of seconds to wait before trying again, one per URL, 0 if the message may be sent now
+        """
+        waits = self.backend.take_many(urls, self.rate, self.burst)
+        if self.global_rate:
+            granted = [index for index, wait in enumerate(waits) if not wait]
+            refunds = []
+            global_waits = self.backend.take_many([GLOBAL_KEY] * len(granted), self.global_rate, self.global_burst)
+            for index, wait in zip(granted, global_waits):
+                if wait:
+                    waits[index] = wait
+                    refunds.append(urls[index])
+            if refunds:
+                self.backend.take_many(refunds, self.rate, self.burst, cost=-1)
+        return waits
@@ -0,0 +1,192 @@
+import threading
+import time
+
+from app import db
+from app.config import Config
+from app.models import Notifications, Topic, notification_topics, RegistryVersion
+
+
+class ChannelEntry:
+    """
+    The few columns of a Notifications row the sender needs. Attribute names match the model so an entry can be used
+    anywhere a Notifications row is expected when sending.
+    """
+    __slots__ = ('id', 'name', 'channel_url', 'channel_type')
+
+    def __init__(self, id, name, channel_url, channel_type='teams'):
+        self.id = id
+        self.name = name
+        self.channel_url = channel_url
+        self.channel_type = channel_type or 'teams'
+
+    def __repr__(self):
+        return f"ChannelEntry('{self.id}', '{self.name}')"
+
+
+class ChannelRegistry:
+    """
+    In memory registry of enabled channels, so finding the recipients of a message doesn't need the notifications
+    table. The web routes bump the version row in the same transaction as any change to a notification (see changed)
+    and then update their own registry in place with that version. Lookups compare the row with the version the
+    registry is at, at most every check_interval seconds, so gunicorn workers and the outbox worker pick up each
+    other's changes with one primary key read. The ttl reloads it now and then anyway, for changes made outside the
+    app.
+
+    Topic subscribers are looked up with one query on the notification_topics index the first time a set of topics is
+    asked for, and cached until the registry changes.
+    """
+    def __init__(self, ttl=None, check_interval=2):
+        """
+        :param ttl: Optional number of seconds after which the registry is reloaded
+        :param check_interval: Seconds between checks of the version row, 0 checks on every lookup
+        """
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._version = None
+        self._checked = 0
+        self._entries = None
+        self._names = {}
+        self._topics = {}
+        self._enabled = ()
+        self._loaded = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _read_version(connection):
+        row = connection.execute(RegistryVersion.__table__.select().where(RegistryVersion.id == 1)).fetchone()
+        return row.version if row is not None else 0
+
+    def _load(self):
+        # On a connection of its own rather than the session, so a long lived session in the worker can't keep
+        # showing an old version, and the version is read together with the rows it belongs to
+        table = Notifications.__table__
+        with db.engine.connect() as connection:
+            self._version = self._read_version(connection)
+            rows = connection.execute(table.select().where(table.c.enabled == 1))
+            self._entries = {row.id: ChannelEntry(row.id, row.name, row.channel_url, row.channel_type) for row in rows}
+        self._refresh()
+        self._loaded = self._checked = time.monotonic()
+
+    def _refresh(self):
+        self._enabled = tuple(self._entries.values())
+        self._names = {entry.name: entry for entry in self._enabled}
+        self._topics = {}
+
+    def _stale(self):
+        if self._entries is None or (self.ttl and time.monotonic() - self._loaded > self.ttl):
+            return True
+        if time.monotonic() - self._checked < self.check_interval:
+            return False
+        with db.engine.connect() as connection:
+            version = self._read_version(connection)
+        self._checked = time.monotonic()
+        return version != self._version
+
+    def _current(self):
+        loaded = self._loaded
+        if self._stale():
+            with self._lock:
+                # Unless another thread reloaded it while this one waited for the lock
+                if self._entries is None or self._loaded == loaded:
+                    self._load()
+        return self._entries
+
+    def enabled(self):
+        """
+        :return: Tuple of ChannelEntry for every enabled channel
+        """
+        self._current()
+        return self._enabled
+
+    def get(self, ids):
+        """
+        :param ids: Notification ids
+        :return: List of ChannelEntry for the ids that are enabled
+        """
+        entries = self._current()
+        return [entries[channel_id] for channel_id in ids if channel_id in entries]
+
+    def get_by_name(self, names):
+        """
+        :param names: Team names
+        :return: Dict of name to ChannelEntry for the names that are enabled
+        """
+        self._current()
+        lookup = self._names
+        return {name: lookup[name] for name in names if name in lookup}
+
+    def subscribers(self, topics):
+        """
+        :param topics: Topic names
+        :return: List of ChannelEntry for the enabled channels subscribed to any of the topics
+        """
+        entries = self._current()
+        key = frozenset(topics)
+        ids = self._topics.get(key)
+        if ids is None:
+            rows = db.session.query(notification_topics.c.notification_id) \
+                .join(Topic, Topic.id == notification_topics.c.topic_id) \
+                .filter(Topic.name.in_(key)).distinct()
+            ids = self._topics[key] = tuple(row.notification_id for row in rows)
+        return [entries[channel_id] for channel_id in ids if channel_id in entries]
+
+    @staticmethod
+    def changed():
+        """
+        Bumps the version row in the caller's session, so every other process reloads its registry once the change is
+        committed. Call it before committing any change to the notifications table or to a team's topics.
+
+        :return: The new version, to pass to upsert or discard once the change is committed
+        """
+        bumped = RegistryVersion.query.filter(RegistryVersion.id == 1).update(
+            {RegistryVersion.version: RegistryVersion.version + 1}, synchronize_session=False)
+        if not bumped:
+            db.session.add(RegistryVersion(id=1, version=1))
+            return 1
+        return db.session.query(RegistryVersion.version).filter(RegistryVersion.id == 1).scalar()
+
+    def _apply(self, version, update):
+        with self._lock:
+            if self._entries is None:
+                return
+            if self._version != version - 1:
+                # Another process changed the registry in between, the in place update would miss its change
+                self._entries = None
+                return
+            update(self._entries)
+            self._version = version
+            self._refresh()
+
+    def upsert(self, notification, version):
+        """
+        Updates a single channel after its row was created or edited, without reloading the registry
+
+        :param notification: Notifications row
+        :param version: Version returned by changed in the transaction that saved the row
+        """
+        def update(entries):
+            if notification.enabled:
+                entries[notification.id] = ChannelEntry(notification.id, notification.name,
+                                                        notification.channel_url, notification.channel_type)
+            else:
+                entries.pop(notification.id, None)
+        self._apply(version, update)
+
+    def discard(self, notification_id, version):
+        """
+        Removes a single channel after its row was deleted or disabled, without reloading the registry
+
+        :param notification_id: Notifications id
+        :param version: Version returned by changed in the transaction that changed the row
+        """
+        self._apply(version, lambda entries: entries.pop(notification_id, None))
+
+    def invalidate(self):
+        """
+        Throws the registry away, it is reloaded on the next lookup
+        """
+        with self._lock:
+            self._entries = None
+
+
+channels = ChannelRegistry(ttl=Config.NOTIFY_REGISTRY_TTL, check_interval=Config.NOTIFY_REGISTRY_CHECK_INTERVAL)
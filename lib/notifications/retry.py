@@ -0,0 +1,78 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+
+THROTTLED = 'throttled'
+SERVER = 'server'
+CLIENT = 'client'
+NETWORK = 'network'
+
+
+def parse_retry_after(value):
+    """
+    Parses a Retry-After header, which is either a number of seconds or an HTTP date
+
+    :param value: Header value
+    :return: Seconds to wait, or None if the header is missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def classify(result):
+    """
+    Works out which class of error a failed delivery belongs to
+
+    :param result: DeliveryResult
+    :return: One of THROTTLED, SERVER, CLIENT or NETWORK
+    """
+    if result.status is None:
+        return NETWORK
+    if result.status == 429:
+        return THROTTLED
+    if result.status >= 500:
+        return SERVER
+    return CLIENT
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter, capped per error class. Teams throttles with 429 and usually says how long
+    to wait in Retry-After, which is always honoured. Other 4xx responses mean the request itself is wrong so they are
+    not retried by default.
+    """
+    default_attempts = {THROTTLED: 8, SERVER: 5, NETWORK: 5, CLIENT: 1}
+
+    def __init__(self, base=1.0, cap=300.0, max_attempts=None):
+        """
+        :param base: Delay before the first retry in seconds
+        :param cap: Longest delay between two attempts in seconds
+        :param max_attempts: Optional dict of error class to maximum attempts, merged over the defaults
+        """
+        self.base = base
+        self.cap = cap
+        self.max_attempts = dict(self.default_attempts, **(max_attempts or {}))
+
+    def delay(self, result, attempt):
+        """
+        Works out how long to wait before trying a failed delivery again
+
+        :param result: Failed DeliveryResult
+        :param attempt: Number of attempts made so far
+        :return: Seconds to wait, or None to give up
+        """
+        if attempt >= self.max_attempts[classify(result)]:
+            return None
+        backoff = random.uniform(0, min(self.cap, self.base * 2 ** (attempt - 1)))
+        if result.retry_after is not None:
+            return result.retry_after + backoff * 0.1
+        return backoff
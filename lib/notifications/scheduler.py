@@ -0,0 +1,285 @@
+import copy
+import json
+import time
+from datetime import datetime, timedelta
+
+from app import db
+from app.config import Config
+from app.models import Schedule, DigestItem
+from lib.notifications import outbox
+from lib.notifications.registry import channels
+import logging as logger
+
+
+# (lowest, highest) of each cron field: minute, hour, day of month, month, day of week (0 and 7 are Sunday)
+_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _parse_field(field, lowest, highest):
+    """
+    Parses one cron field, e.g. '*', '*/15', '1-5', '0,30' or '9-17/2'
+
+    :return: Set of allowed values
+    """
+    values = set()
+    for part in field.split(','):
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+            if step < 1:
+                raise ValueError(f"Bad step in cron field '{field}'")
+        else:
+            step = 1
+        if part == '*':
+            start, end = lowest, highest
+        elif '-' in part:
+            start, end = (int(value) for value in part.split('-', 1))
+        else:
+            start = int(part)
+            end = highest if step > 1 else start
+        if not lowest <= start <= end <= highest:
+            raise ValueError(f"Cron field '{field}' is out of range {lowest}-{highest}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpression:
+    """
+    A standard five field cron expression: minute hour day-of-month month day-of-week. As in cron, when both day
+    fields are restricted a day matching either of them will do.
+    """
+    def __init__(self, expression):
+        """
+        :param expression: e.g. '0 9 * * 1-5' for 09:00 on weekdays
+        """
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression '{expression}' needs 5 fields")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_field(field, lowest, highest) for field, (lowest, highest) in zip(fields, _FIELDS))
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def _day_matches(self, when):
+        in_days = when.day in self.days
+        # Python counts weekdays from Monday, cron from Sunday
+        in_weekdays = (when.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_after(self, timestamp):
+        """
+        :param timestamp: Unix time
+        :return: Unix time of the first matching minute after timestamp, in local time
+        """
+        when = datetime.fromtimestamp(timestamp).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = when.year + 5
+        while when.year <= limit:
+            if when.month not in self.months:
+                when = (when.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._day_matches(when):
+                when = (when + timedelta(days=1)).replace(hour=0, minute=0)
+            elif when.hour not in self.hours:
+                when = (when + timedelta(hours=1)).replace(minute=0)
+            elif when.minute not in self.minutes:
+                when += timedelta(minutes=1)
+            else:
+                return when.timestamp()
+        raise ValueError(f"Cron expression '{self.expression}' never matches")
+
+
+def combine(payloads, max_sections=10):
+    """
+    Combines several cards into one digest card. Every card becomes a section of the digest, cards past max_sections
+    are only counted since Teams won't show a card with too many sections.
+
+    :param payloads: List of card payload dicts, oldest first
+    :param max_sections: Most sections in the digest card
+    :return: Card payload dict
+    """
+    if len(payloads) == 1:
+        return payloads[0]
+    sections = []
+    for payload in payloads:
+        if payload.get('sections'):
+            section = copy.deepcopy(payload['sections'][0])
+            section.setdefault('activityTitle', payload.get('title') or payload.get('summary'))
+        else:
+            section = {'activityTitle': payload.get('title') or payload.get('summary')}
+        if payload.get('text') and 'text' not in section:
+            section['text'] = payload['text']
+        sections.append(section)
+    digest = {'@type': 'MessageCard', '@context': 'https://schema.org/extensions',
+              'summary': f"{len(payloads)} updates", 'title': f"Digest of {len(payloads)} updates",
+              'sections': sections[:max_sections]}
+    if payloads[-1].get('themeColor'):
+        digest['themeColor'] = payloads[-1]['themeColor']
+    if len(sections) > max_sections:
+        digest['sections'].append({'text': f"and {len(sections) - max_sections} more"})
+    return digest
+
+
+def add_schedule(name, cron, payload, targets=None, priority=outbox.NORMAL):
+    """
+    Adds a recurring message
+
+    :param name: Unique schedule name
+    :param cron: Cron expression, e.g. '0 9 * * 1-5'
+    :param payload: Card payload dict
+    :param targets: Optional list of notification ids, defaults to every enabled team
+    :param priority: Outbox lane the message is queued in
+    :return: Schedule id
+    """
+    now = time.time()
+    row = Schedule(name=name, cron=cron, payload=json.dumps(payload),
+                   targets=json.dumps(targets) if targets is not None else None, priority=priority, enabled=1,
+                   next_run=CronExpression(cron).next_after(now), created=now, updated=now)
+    db.session.add(row)
+    db.session.commit()
+    return row.id
+
+
+def remove_schedule(schedule_id):
+    """
+    :param schedule_id: Schedule id
+    :return: True if the schedule existed
+    """
+    removed = Schedule.query.filter(Schedule.id == schedule_id).delete()
+    db.session.commit()
+    return bool(removed)
+
+
+def digest(payload, targets=None):
+    """
+    Holds a low priority message back so it goes out in the next digest card instead of on its own
+
+    :param payload: Card payload dict
+    :param targets: Optional list of notification ids, defaults to every enabled team
+    :return: Digest item id
+    """
+    row = DigestItem(payload=json.dumps(payload), targets=json.dumps(targets) if targets is not None else None,
+                     created=time.time())
+    db.session.add(row)
+    db.session.commit()
+    return row.id
+
+
+def digest_many(messages):
+    """
+    Holds several messages back for the digest in a single transaction
+
+    :param messages: Iterable of dicts with 'payload' and optionally 'targets'
+    :return: Number of messages held back
+    """
+    now = time.time()
+    rows = [{'payload': json.dumps(message['payload']),
+             'targets': json.dumps(message['targets']) if message.get('targets') is not None else None,
+             'created': now} for message in messages]
+    db.session.bulk_insert_mappings(DigestItem, rows)
+    db.session.commit()
+    return len(rows)
+
+
+class Scheduler:
+    """
+    Runs inside the outbox worker. Due schedules are put on the outbox and once the digest interval has passed every
+    team gets one combined card of the messages held back for it, so nothing has to start the app from cron. Several
+    workers can run at once, a schedule or digest is only taken by the worker whose update claims it.
+    """
+    def __init__(self, tick=5, digest_interval=900, max_sections=10):
+        """
+        :param tick: Seconds between checks
+        :param digest_interval: Seconds a digest collects messages before it is sent
+        :param max_sections: Most sections in a digest card
+        """
+        self.tick = tick
+        self.digest_interval = digest_interval
+        self.max_sections = max_sections
+        self._checked = 0.0
+
+    def run_once(self):
+        """
+        Queues whatever is due, at most once per tick
+
+        :return: Number of messages queued
+        """
+        now = time.time()
+        if now - self._checked < self.tick:
+            return 0
+        self._checked = now
+        return self.run_due(now) + self.flush_digests(now)
+
+    def run_due(self, now=None):
+        """
+        Puts every schedule that is due on the outbox and works out when it next runs
+
+        :param now: Optional Unix time
+        :return: Number of messages queued
+        """
+        now = now or time.time()
+        queued = 0
+        for row in Schedule.query.filter(Schedule.enabled == 1, Schedule.next_run <= now).all():
+            try:
+                next_run = CronExpression(row.cron).next_after(now)
+            except ValueError as e:
+                logger.error(f"Disabling schedule {row.name}: {e}")
+                Schedule.query.filter(Schedule.id == row.id).update({Schedule.enabled: 0, Schedule.updated: now},
+                                                                    synchronize_session=False)
+                db.session.commit()
+                continue
+            payload, targets, priority = json.loads(row.payload), row.targets, row.priority
+            claimed = Schedule.query.filter(Schedule.id == row.id, Schedule.next_run == row.next_run).update(
+                {Schedule.next_run: next_run, Schedule.last_run: now, Schedule.updated: now},
+                synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                outbox.enqueue(payload, json.loads(targets) if targets else None, priority=priority)
+                queued += 1
+        return queued
+
+    def flush_digests(self, now=None):
+        """
+        Sends the digest once the oldest held back message has waited digest_interval. Every team gets one card of
+        the messages held back for it, whatever targets they were held back with, and teams with the same messages
+        share a card. Messages held back for every team go to the teams enabled now. The held back messages are
+        taken and the cards queued in one transaction.
+
+        :param now: Optional Unix time
+        :return: Number of digest cards queued
+        """
+        now = now or time.time()
+        rows = DigestItem.query.order_by(DigestItem.id).all()
+        if not rows or now - rows[0].created < self.digest_interval:
+            return 0
+        enabled = None
+        per_channel = {}
+        for row in rows:
+            if row.targets is None:
+                if enabled is None:
+                    enabled = [team.id for team in channels.enabled()]
+                targets = enabled
+            else:
+                targets = json.loads(row.targets)
+            for channel_id in dict.fromkeys(targets):
+                per_channel.setdefault(channel_id, []).append(row)
+        groups = {}
+        for channel_id, items in per_channel.items():
+            groups.setdefault(tuple(row.id for row in items), []).append(channel_id)
+        payloads = {row.id: json.loads(row.payload) for row in rows}
+        taken = DigestItem.query.filter(DigestItem.id.in_(list(payloads))).delete(synchronize_session=False)
+        if taken != len(payloads):
+            # Another worker got to some of these first, leave the digest to it
+            db.session.rollback()
+            return 0
+        queued = outbox.enqueue_many([{'payload': combine([payloads[row_id] for row_id in ids], self.max_sections),
+                                       'targets': targets, 'priority': outbox.BULK}
+                                      for ids, targets in groups.items()], commit=False)
+        db.session.commit()
+        return queued
+
+
+scheduler = Scheduler(tick=Config.NOTIFY_SCHEDULE_TICK, digest_interval=Config.NOTIFY_DIGEST_INTERVAL,
+                      max_sections=Config.NOTIFY_DIGEST_MAX_SECTIONS)
@@ -0,0 +1,182 @@
+import os
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from email.message import EmailMessage
+
+from lib.notifications.fanout import DeliveryResult
+import logging as logger
+
+
+def smtp_status(code):
+    """
+    Results carry HTTP style statuses so the retry policy treats email like a webhook: a temporary SMTP failure (4xx)
+    is reported as 503 and retried, a permanent one (5xx) as 400 and not retried.
+
+    :param code: SMTP reply code
+    :return: HTTP style status
+    """
+    if code < 400:
+        return 200
+    return 503 if code < 500 else 400
+
+
+class SMTPPool:
+    """
+    Keeps SMTP connections open between messages, so sending a batch doesn't pay for a connect, STARTTLS and login
+    per message. At most size connections are open at once, idle ones older than max_idle seconds are closed before
+    they are used since servers drop idle clients. Like the transport, the pool starts over after a fork.
+    """
+    def __init__(self, host, port=25, use_tls=False, username=None, password=None, size=4, timeout=10, max_idle=60):
+        """
+        :param host: SMTP server
+        :param port: SMTP port
+        :param use_tls: Upgrade connections with STARTTLS
+        :param username: Optional login
+        :param password: Optional password
+        :param size: Most connections open at once
+        :param timeout: Socket timeout in seconds
+        :param max_idle: Seconds an idle connection is kept for
+        """
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _open(self):
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            connection.starttls()
+        if self.username:
+            connection.login(self.username, self.password)
+        return connection
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+    def _take(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._idle, self._pid = [], os.getpid()
+            while self._idle:
+                connection, used = self._idle.pop()
+                if time.monotonic() - used < self.max_idle:
+                    return connection
+                self._close(connection)
+        return self._open()
+
+    @contextmanager
+    def connection(self):
+        """
+        Lends out a connection. It goes back in the pool afterwards unless the server hung up or the socket failed.
+        """
+        with self._slots:
+            connection = self._take()
+            healthy = False
+            try:
+                yield connection
+                healthy = True
+            except smtplib.SMTPResponseException:
+                # The server answered, only this message was refused
+                healthy = True
+                raise
+            finally:
+                if healthy:
+                    with self._lock:
+                        self._idle.append((connection, time.monotonic()))
+                else:
+                    self._close(connection)
+
+    def close(self):
+        """
+        Closes every idle connection
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._close(connection)
+
+
+class EmailSender:
+    """
+    Sends emails through the pool. A batch goes out over a single connection.
+    """
+    def __init__(self, pool, sender):
+        """
+        :param pool: SMTPPool
+        :param sender: From address
+        """
+        self.pool = pool
+        self.sender = sender
+
+    def build(self, to, subject, body):
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = ', '.join(to)
+        message['Subject'] = subject
+        message.set_content(body)
+        return message
+
+    def send_many(self, emails):
+        """
+        :param emails: List of dicts with 'to' (list of addresses), 'subject' and 'body'
+        :return: List of DeliveryResult, one per email
+        """
+        results = []
+        pending = list(emails)
+        # A pooled connection may have been dropped by the server, in which case the rest of the batch is tried once
+        # more on a fresh connection
+        for _ in range(2):
+            try:
+                with self.pool.connection() as connection:
+                    while pending:
+                        results.append(self._send(connection, pending[0]))
+                        pending.pop(0)
+            except (smtplib.SMTPException, OSError) as e:
+                error = e
+                continue
+            return results
+        logger.error(f"Caught exception sending email: {error}")
+        url = f"smtp://{self.pool.host}:{self.pool.port}"
+        return results + [DeliveryResult(', '.join(email['to']), url, False, str(error)) for email in pending]
+
+    def _send(self, connection, email):
+        url = f"mailto:{','.join(email['to'])}"
+        start = time.monotonic()
+        try:
+            message = self.build(email['to'], email['subject'], email['body'])
+        except ValueError as e:
+            # Bad headers, such as a line break in the subject, won't get better by retrying
+            return DeliveryResult(', '.join(email['to']), url, False, f"Invalid email: {e}", status=400)
+        try:
+            connection.send_message(message)
+        except smtplib.SMTPRecipientsRefused as e:
+            code = min(reply[0] for reply in e.recipients.values())
+            return DeliveryResult(', '.join(email['to']), url, False, f"SMTP {code}: recipients refused",
+                                  time.monotonic() - start, smtp_status(code))
+        except smtplib.SMTPResponseException as e:
+            error = e.smtp_error.decode(errors='replace') if isinstance(e.smtp_error, bytes) else e.smtp_error
+            return DeliveryResult(', '.join(email['to']), url, False, f"SMTP {e.smtp_code}: {error}",
+                                  time.monotonic() - start, smtp_status(e.smtp_code))
+        return DeliveryResult(', '.join(email['to']), url, True, elapsed=time.monotonic() - start, status=200)
+
+    def send(self, to, subject, body):
+        """
+        :param to: List of addresses
+        :param subject: Subject line
+        :param body: Plain text body
+        :return: DeliveryResult
+        """
+        return self.send_many([{'to': to, 'subject': subject, 'body': body}])[0]
@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+import logging as logger
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class TransportStats:
+    """
+    Counters for the shared transport. 'reused' is every request that did not need a new connection, so on a healthy
+    broadcast 'opened' should stay close to the pool size while 'reused' grows with the number of sends.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.opened = 0
+
+    def request(self):
+        with self._lock:
+            self.requests += 1
+
+    def connection(self):
+        with self._lock:
+            self.opened += 1
+
+    @property
+    def reused(self):
+        return max(self.requests - self.opened, 0)
+
+    def as_dict(self):
+        return {'requests': self.requests, 'opened': self.opened, 'reused': self.reused}
+
+
+def _counting_pool(base, stats):
+    """
+    Builds a urllib3 connection pool class that counts every new connection it has to open
+    """
+    class CountingPool(base):
+        def _new_conn(self):
+            stats.connection()
+            return super()._new_conn()
+    return CountingPool
+
+
+class _CountingAdapter(HTTPAdapter):
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool(HTTPConnectionPool, self.stats),
+            'https': _counting_pool(HTTPSConnectionPool, self.stats),
+        }
+
+
+class Transport:
+    """
+    Process wide HTTP client used for every webhook send. Connections to the Office 365 webhook host are kept alive
+    and pooled, so a broadcast only pays for the TCP and TLS handshake once per pooled connection instead of once per
+    channel. HTTP/2 is used when enabled and httpx is installed, otherwise requests is used.
+    """
+    def __init__(self, pool_size=32, http2=False):
+        """
+        :param pool_size: Maximum number of kept alive connections per host
+        :param http2: Use HTTP/2 (requires httpx[http2])
+        """
+        self.pool_size = pool_size
+        if http2 and httpx is None:
+            logger.warning("HTTP/2 requested but httpx is not installed, falling back to HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self.stats = TransportStats()
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _build_client(self):
+        if self.http2:
+            limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            return httpx.Client(http2=True, limits=limits)
+        session = requests.Session()
+        adapter = _CountingAdapter(self.stats, pool_connections=4, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @property
+    def client(self):
+        """
+        The pooled client for this process. It is rebuilt after a fork so gunicorn workers never share sockets.
+        """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._client = self._build_client()
+                    self._pid = os.getpid()
+        return self._client
+
+    def _trace(self, event, info):
+        if event == 'connection.connect_tcp.complete':
+            self.stats.connection()
+
+    def post(self, url, payload, timeout=None, proxies=None, verify=None):
+        """
+        Posts a JSON payload to a webhook
+
+        :param url: Webhook URL
+        :param payload: Dict to be sent as JSON, or already serialized bytes
+        :param timeout: Timeout in seconds
+        :param proxies: Optional proxies, only used for HTTP/1.1
+        :param verify: Optional TLS verification setting, only used for HTTP/1.1
+        :return: Response object with status_code, headers and text
+        """
+        if not isinstance(payload, (bytes, str)):
+            payload = json.dumps(payload)
+        headers = {'Content-Type': 'application/json'}
+        self.stats.request()
+        if self.http2:
+            return self.client.post(url, content=payload, headers=headers, timeout=timeout,
+                                    extensions={'trace': self._trace})
+        return self.client.post(url, data=payload, headers=headers, timeout=timeout, proxies=proxies,
+                                verify=True if verify is None else verify)
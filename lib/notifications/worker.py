@@ -0,0 +1,128 @@
+import json
+import os
+import socket
+import time
+import uuid
+
+from app import db
+from app.config import Config
+from lib.notifications import notification, broadcast, outbox, metrics, email_sender, retry_policy
+from lib.notifications.scheduler import scheduler
+from lib.notifications import deliveries
+import logging as logger
+
+
+class OutboxWorker:
+    """
+    Drains the outbox in batches. Run as many of these as you like, each one claims its own batch of messages. The
+    worker also runs the scheduler, so recurring messages and digests go out without anything else running.
+    """
+    def __init__(self, batch_size=None, lease_seconds=None, poll_interval=None, retry_budget=None):
+        """
+        :param batch_size: Messages claimed per batch
+        :param lease_seconds: How long a message is leased for before other workers may take it over. Each message
+            gets a fresh lease right before it is sent, so this has to cover sending one message, not the batch.
+        :param poll_interval: Seconds to sleep when the outbox is empty
+        :param retry_budget: Seconds a message may keep retrying before its failed sends go back on the outbox,
+            defaults to NOTIFY_WORKER_RETRY_BUDGET so one flaky channel doesn't hold up the messages behind it
+        """
+        self.batch_size = batch_size or Config.NOTIFY_BATCH_SIZE
+        self.lease_seconds = lease_seconds or Config.NOTIFY_LEASE_SECONDS
+        self.poll_interval = poll_interval or Config.NOTIFY_POLL_INTERVAL
+        self.retry_budget = Config.NOTIFY_WORKER_RETRY_BUDGET if retry_budget is None else retry_budget
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._compacted = 0.0
+
+    def run_once(self):
+        """
+        Queues due schedules and digests, then claims and sends one batch. Repeats of a dedup key are held back when
+        the batch is claimed and summed up once their window closes. The batch's deliveries are logged in one write
+        and old deliveries are compacted every NOTIFY_DELIVERY_COMPACT_INTERVAL seconds.
+
+        :return: Number of messages handled
+        """
+        queued = scheduler.run_once()
+        rows = outbox.claim(self.worker_id, self.batch_size, self.lease_seconds, Config.NOTIFY_LANE_WEIGHTS)
+        claimed = len(rows)
+        rows = outbox.suppress_repeats(rows, self.worker_id, Config.NOTIFY_DEDUP_WINDOW)
+        emails = [row for row in rows if row.kind == outbox.EMAIL]
+        if emails:
+            self.deliver_emails(emails)
+        for row in rows:
+            if row.kind != outbox.EMAIL:
+                self.deliver(row)
+        deliveries.delivery_log.flush()
+        if time.time() - self._compacted >= Config.NOTIFY_DELIVERY_COMPACT_INTERVAL:
+            self._compacted = time.time()
+            deliveries.compact(Config.NOTIFY_DELIVERY_RETENTION_DAYS)
+        coalesced = outbox.close_windows(Config.NOTIFY_DEDUP_WINDOW)
+        return queued + claimed + coalesced
+
+    def deliver(self, row):
+        """
+        Sends one outbox message to its teams and records the outcome
+
+        :param row: Claimed Outbox row
+        :return: List of DeliveryResult, one per team. Empty when another worker took the message over.
+        """
+        if not outbox.renew(row.id, self.worker_id, self.lease_seconds):
+            logger.warning(f"Lease on outbox message {row.id} was lost, leaving it to the worker that took it over")
+            return []
+        payload = json.loads(row.payload)
+        if row.targets is not None:
+            teams = notification.get_by_ids(json.loads(row.targets))
+        else:
+            teams = notification.get_enabled()
+        results = broadcast(payload, teams, row.attempts + 1, priority=row.priority, message_id=str(row.id),
+                            retry_budget=self.retry_budget)
+        failed = [result for result in results if not result.ok and not result.deferred and not result.skipped]
+        error = '; '.join(f"{result.channel}: {result.error}" for result in failed) or None
+        self._complete(row, error)
+        metrics.lane_latency.observe(time.time() - row.created, outbox.LANE_NAMES.get(row.priority, 'normal'))
+        return results
+
+    def deliver_emails(self, rows):
+        """
+        Sends a batch of outbox emails over one SMTP connection. Temporary failures go back on the queue with a
+        backoff, the rest are marked failed.
+
+        :param rows: Claimed Outbox rows of kind EMAIL
+        :return: List of DeliveryResult, one per email the worker still held
+        """
+        rows = [row for row in rows if outbox.renew(row.id, self.worker_id, self.lease_seconds)]
+        results = email_sender.send_many([json.loads(row.payload) for row in rows])
+        for row, result in zip(rows, results):
+            result.attempts = row.attempts + 1
+            delay = None if result.ok else retry_policy.delay(result, result.attempts)
+            if result.ok:
+                self._complete(row)
+            elif delay is None:
+                self._complete(row, result.error)
+            else:
+                metrics.retries.inc('error')
+                result.retry_at = time.time() + delay
+                outbox.retry(row, delay, result.error, self.worker_id)
+            deliveries.delivery_log.record(str(row.id), [result])
+            metrics.sends.inc('email', 'success' if result.ok else 'failure')
+            metrics.lane_latency.observe(time.time() - row.created, outbox.LANE_NAMES.get(row.priority, 'normal'))
+        return results
+
+    def _complete(self, row, error=None, status=None):
+        if not outbox.complete(row, error, status, self.worker_id):
+            logger.warning(f"Lease on outbox message {row.id} ran out while it was being sent")
+
+    def run(self):
+        """
+        Keeps draining the outbox until interrupted
+        """
+        logger.info(f"Outbox worker {self.worker_id} started")
+        while True:
+            try:
+                handled = self.run_once()
+            except Exception as e:
+                logger.error(f"Caught exception draining outbox: {e}")
+                # A failed flush or commit leaves the session unusable until it is rolled back
+                db.session.rollback()
+                handled = 0
+            if not handled:
+                time.sleep(self.poll_interval)
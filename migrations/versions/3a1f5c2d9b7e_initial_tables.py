@@ -0,0 +1,49 @@
+"""initial tables
+
+Revision ID: 3a1f5c2d9b7e
+Revises: 
+Create Date: 2026-10-18 09:12:41.503112
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a1f5c2d9b7e'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=80), nullable=True),
+    sa.Column('password', sa.String(length=80), nullable=True),
+    sa.Column('firstname', sa.String(length=80), nullable=True),
+    sa.Column('lastname', sa.String(length=80), nullable=True),
+    sa.Column('email', sa.String(length=120), nullable=True),
+    sa.Column('disabled', sa.Integer(), nullable=True),
+    sa.Column('admin', sa.Integer(), nullable=True),
+    sa.Column('token', sa.String(length=1000), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email'),
+    sa.UniqueConstraint('username')
+    )
+    op.create_table('notifications',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('channel_url', sa.String(), nullable=True),
+    sa.Column('enabled', sa.Integer(), nullable=True),
+    sa.Column('created', sa.String(), nullable=True),
+    sa.Column('updated', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('channel_url'),
+    sa.UniqueConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('notifications')
+    op.drop_table('users')
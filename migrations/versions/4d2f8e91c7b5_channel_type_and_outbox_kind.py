@@ -0,0 +1,32 @@
+"""channel type and outbox kind
+
+Revision ID: 4d2f8e91c7b5
+Revises: e5a97c3b1f48
+Create Date: 2026-10-18 16:48:12.930415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d2f8e91c7b5'
+down_revision = 'e5a97c3b1f48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('notification_outbox', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('kind', sa.String(length=16), server_default='card', nullable=True))
+
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('channel_type', sa.String(length=16), server_default='teams', nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.drop_column('channel_type')
+
+    with op.batch_alter_table('notification_outbox', schema=None) as batch_op:
+        batch_op.drop_column('kind')
@@ -0,0 +1,93 @@
+"""delivery tables and indexes
+
+Revision ID: 7c4e2b8a1d60
+Revises: 3a1f5c2d9b7e
+Create Date: 2026-10-18 09:14:02.118734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c4e2b8a1d60'
+down_revision = '3a1f5c2d9b7e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('notification_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=True),
+    sa.Column('targets', sa.Text(), nullable=True),
+    sa.Column('status', sa.String(length=16), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=True),
+    sa.Column('lease_owner', sa.String(length=64), nullable=True),
+    sa.Column('lease_expires', sa.Float(), nullable=True),
+    sa.Column('available_at', sa.Float(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('dedup_key', sa.String(length=255), nullable=True),
+    sa.Column('batch_id', sa.String(length=32), nullable=True),
+    sa.Column('priority', sa.Integer(), nullable=True),
+    sa.Column('created', sa.Float(), nullable=True),
+    sa.Column('updated', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('notification_outbox', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_notification_outbox_batch_id'), ['batch_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_notification_outbox_priority'), ['priority'], unique=False)
+        batch_op.create_index(batch_op.f('ix_notification_outbox_status'), ['status'], unique=False)
+        batch_op.create_index('ix_notification_outbox_claim', ['status', 'priority', 'available_at'], unique=False)
+
+    op.create_table('rate_limit_buckets',
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('tokens', sa.Float(), nullable=True),
+    sa.Column('updated', sa.Float(), nullable=True),
+    sa.Column('version', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_table('topics',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=80), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('topics', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_topics_name'), ['name'], unique=True)
+
+    op.create_table('notification_topics',
+    sa.Column('notification_id', sa.Integer(), nullable=False),
+    sa.Column('topic_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['notification_id'], ['notifications.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['topic_id'], ['topics.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('notification_id', 'topic_id')
+    )
+    with op.batch_alter_table('notification_topics', schema=None) as batch_op:
+        batch_op.create_index('ix_notification_topics_topic_id', ['topic_id', 'notification_id'], unique=False)
+
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('disabled_reason', sa.String(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_notifications_enabled'), ['enabled'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_notifications_enabled'))
+        batch_op.drop_column('disabled_reason')
+
+    with op.batch_alter_table('notification_topics', schema=None) as batch_op:
+        batch_op.drop_index('ix_notification_topics_topic_id')
+
+    op.drop_table('notification_topics')
+    with op.batch_alter_table('topics', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_topics_name'))
+
+    op.drop_table('topics')
+    op.drop_table('rate_limit_buckets')
+    with op.batch_alter_table('notification_outbox', schema=None) as batch_op:
+        batch_op.drop_index('ix_notification_outbox_claim')
+        batch_op.drop_index(batch_op.f('ix_notification_outbox_status'))
+        batch_op.drop_index(batch_op.f('ix_notification_outbox_priority'))
+        batch_op.drop_index(batch_op.f('ix_notification_outbox_batch_id'))
+
+    op.drop_table('notification_outbox')
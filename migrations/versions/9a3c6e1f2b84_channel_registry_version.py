@@ -0,0 +1,29 @@
+"""channel registry version
+
+Revision ID: 9a3c6e1f2b84
+Revises: 4d2f8e91c7b5
+Create Date: 2026-10-18 18:02:41.118306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a3c6e1f2b84'
+down_revision = '4d2f8e91c7b5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table = op.create_table('channel_registry_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.bulk_insert(table, [{'id': 1, 'version': 0}])
+
+
+def downgrade():
+    op.drop_table('channel_registry_version')
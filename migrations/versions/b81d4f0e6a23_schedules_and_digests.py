@@ -0,0 +1,52 @@
+"""schedules and digests
+
+Revision ID: b81d4f0e6a23
+Revises: 7c4e2b8a1d60
+Create Date: 2026-10-18 13:42:51.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b81d4f0e6a23'
+down_revision = '7c4e2b8a1d60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('notification_digest',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=True),
+    sa.Column('targets', sa.Text(), nullable=True),
+    sa.Column('created', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('notification_schedules',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=80), nullable=True),
+    sa.Column('cron', sa.String(length=100), nullable=True),
+    sa.Column('payload', sa.Text(), nullable=True),
+    sa.Column('targets', sa.Text(), nullable=True),
+    sa.Column('priority', sa.Integer(), nullable=True),
+    sa.Column('enabled', sa.Integer(), nullable=True),
+    sa.Column('next_run', sa.Float(), nullable=True),
+    sa.Column('last_run', sa.Float(), nullable=True),
+    sa.Column('created', sa.Float(), nullable=True),
+    sa.Column('updated', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('notification_schedules', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_notification_schedules_name'), ['name'], unique=True)
+        batch_op.create_index(batch_op.f('ix_notification_schedules_next_run'), ['next_run'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('notification_schedules', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_notification_schedules_next_run'))
+        batch_op.drop_index(batch_op.f('ix_notification_schedules_name'))
+
+    op.drop_table('notification_schedules')
+    op.drop_table('notification_digest')
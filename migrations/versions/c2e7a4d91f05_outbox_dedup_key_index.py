@@ -0,0 +1,26 @@
+"""outbox dedup key index
+
+Revision ID: c2e7a4d91f05
+Revises: 9a3c6e1f2b84
+Create Date: 2026-10-18 18:40:09.502731
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2e7a4d91f05'
+down_revision = '9a3c6e1f2b84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('notification_outbox', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_notification_outbox_dedup_key'), ['dedup_key'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('notification_outbox', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_notification_outbox_dedup_key'))
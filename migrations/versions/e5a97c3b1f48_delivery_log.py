@@ -0,0 +1,54 @@
+"""delivery log
+
+Revision ID: e5a97c3b1f48
+Revises: b81d4f0e6a23
+Create Date: 2026-10-18 15:06:37.551902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a97c3b1f48'
+down_revision = 'b81d4f0e6a23'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('deliveries',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('message_id', sa.String(length=32), nullable=True),
+    sa.Column('channel_id', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(length=16), nullable=True),
+    sa.Column('http_status', sa.Integer(), nullable=True),
+    sa.Column('latency', sa.Float(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=True),
+    sa.Column('error', sa.String(length=500), nullable=True),
+    sa.Column('created', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('deliveries', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_deliveries_created'), ['created'], unique=False)
+        batch_op.create_index(batch_op.f('ix_deliveries_message_id'), ['message_id'], unique=False)
+        batch_op.create_index('ix_deliveries_channel_id_created', ['channel_id', 'created'], unique=False)
+
+    op.create_table('delivery_rollups',
+    sa.Column('day', sa.String(length=10), nullable=False),
+    sa.Column('channel_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=True),
+    sa.Column('total_latency', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('day', 'channel_id', 'status')
+    )
+
+
+def downgrade():
+    op.drop_table('delivery_rollups')
+    with op.batch_alter_table('deliveries', schema=None) as batch_op:
+        batch_op.drop_index('ix_deliveries_channel_id_created')
+        batch_op.drop_index(batch_op.f('ix_deliveries_message_id'))
+        batch_op.drop_index(batch_op.f('ix_deliveries_created'))
+
+    op.drop_table('deliveries')
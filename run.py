@@ -1,4 +1,8 @@
-from app import app
+from app import create_app, init_db
+
+# gunicorn run:app
+app = create_app()
 
 if __name__ == "__main__":
+    init_db(app)
     app.run(debug=True)
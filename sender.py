@@ -0,0 +1,23 @@
+import argparse
+
+from app import create_app
+from lib.notifications import default_message, outbox
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sends the default message without loading the web app, for cron")
+    parser.add_argument('--enqueue', action='store_true', help="put the message on the outbox for a worker to send")
+    parser.add_argument('--topic', action='append', dest='topics', help="only send to teams subscribed to this topic")
+    parser.add_argument('--priority', choices=sorted(outbox.LANES), default='normal')
+    parser.add_argument('--dedup-key', help="repeats of the same key within the dedup window are coalesced by the "
+                                            "outbox worker, needs --enqueue")
+    args = parser.parse_args()
+    if args.dedup_key and not args.enqueue:
+        # Every cron run is a fresh process, so only the outbox remembers earlier messages with the same key
+        parser.error("--dedup-key needs --enqueue")
+    with create_app(web=False).app_context():
+        result = default_message(enqueue=args.enqueue, dedup_key=args.dedup_key,
+                                 priority=outbox.LANES[args.priority], topics=args.topics)
+        if args.enqueue:
+            print(f"Queued message {result}")
+        else:
+            print(f"Sent to {sum(1 for item in result if item.ok)} of {len(result)} teams")
@@ -0,0 +1,36 @@
+import argparse
+
+from app import create_app
+from app.config import Config
+from lib.notifications import metrics, outbox
+from lib.notifications.worker import OutboxWorker
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sends queued Teams notifications")
+    parser.add_argument('--batch-size', type=int, help="messages claimed per batch")
+    parser.add_argument('--once', action='store_true', help="send one batch and exit")
+    parser.add_argument('--metrics-port', type=int, default=Config.NOTIFY_WORKER_METRICS_PORT,
+                        help="serve the send metrics on this port at /metrics, 0 to turn off")
+    parser.add_argument('--dead-letters', action='store_true', help="list the latest dead and failed messages and exit")
+    parser.add_argument('--requeue', type=int, nargs='+', metavar='ID',
+                        help="put dead or failed messages back on the queue and exit")
+    args = parser.parse_args()
+    app = create_app(web=False)
+    if args.dead_letters or args.requeue:
+        with app.app_context():
+            if args.dead_letters:
+                for row in outbox.dead_letters():
+                    print(f"{row.id}\t{row.status}\t{row.attempts} attempts\t{row.targets or 'all'}\t{row.last_error}")
+            for outbox_id in args.requeue or []:
+                print(f"Requeued message {outbox_id}" if outbox.requeue(outbox_id)
+                      else f"Message {outbox_id} is not dead or failed")
+        parser.exit()
+    if args.metrics_port and not args.once:
+        # The sends happen in this process, so this is where their metrics have to be scraped from
+        metrics.registry.serve(args.metrics_port, context=app.app_context)
+    with app.app_context():
+        worker = OutboxWorker(batch_size=args.batch_size)
+        if args.once:
+            worker.run_once()
+        else:
+            worker.run()